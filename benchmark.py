@@ -0,0 +1,734 @@
+from __future__ import annotations
+from typing import Any, AsyncIterator, Callable, Coroutine, Iterator, Optional
+
+from cogs.utils.constants import Colors, Emotes
+from cogs.utils.recorder import Record, read_recording
+from cogs.vanity import Vanity
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+import discord
+import asyncio
+import contextlib
+import dataclasses
+import random
+import time
+import tracemalloc
+
+import config
+
+
+# In-memory stand-ins for everything the Vanity cog touches, just enough
+# to drive its listeners without Discord, PostgreSQL or Redis.
+
+
+class FakeRole:
+    __slots__ = ("id", "name")
+
+    def __init__(self, id: int, name: str = "vanity") -> None:
+        self.id: int = id
+        self.name: str = name
+
+    @property
+    def mention(self) -> str:
+        return f"<@&{self.id}>"
+
+
+class FakeChannel(discord.TextChannel):
+    # passes the isinstance checks in VanityConfig, none of the real
+    # attributes are set
+    def __init__(self, id: int) -> None:
+        self.id = id
+        self.sent: int = 0
+
+    def __repr__(self) -> str:
+        return f"<FakeChannel id={self.id}>"
+
+    async def send(self, *args: Any, **kwargs: Any) -> None:
+        self.sent += 1
+
+
+class FakeGuild:
+    def __init__(self, id: int) -> None:
+        self.id: int = id
+        self.name: str = f"Guild {id}"
+        self.features: list[str] = []
+        self.chunked: bool = True
+        self._members: dict[int, FakeMember] = {}
+        self._roles: dict[int, FakeRole] = {}
+        self._channels: dict[int, FakeChannel] = {}
+
+    @property
+    def members(self) -> list[FakeMember]:
+        return list(self._members.values())
+
+    def get_member(self, member_id: int) -> Optional[FakeMember]:
+        return self._members.get(member_id)
+
+    def get_role(self, role_id: Optional[int]) -> Optional[FakeRole]:
+        return self._roles.get(role_id)  # type: ignore
+
+    def get_channel(self, channel_id: Optional[int]) -> Optional[FakeChannel]:
+        return self._channels.get(channel_id)  # type: ignore
+
+    async def chunk(self, *, cache: bool = True) -> list[FakeMember]:
+        return self.members
+
+    async def leave(self) -> None:
+        pass
+
+
+class FakeMember:
+    __slots__ = ("id", "name", "guild", "bot", "activities", "_roles")
+
+    def __init__(self, id: int, guild: FakeGuild, status: str = "") -> None:
+        self.id: int = id
+        self.name: str = f"user{id}"
+        self.guild: FakeGuild = guild
+        self.bot: bool = False
+        self.activities: tuple[Any, ...] = make_activities(status)
+        self._roles: set[int] = set()
+
+    @property
+    def activity(self) -> Optional[Any]:
+        return self.activities[0] if self.activities else None
+
+    @property
+    def roles(self) -> list[FakeRole]:
+        return [role for role_id in self._roles if (role := self.guild.get_role(role_id))]
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    def get_role(self, role_id: int) -> Optional[FakeRole]:
+        return self.guild.get_role(role_id) if role_id in self._roles else None
+
+    def _copy(self) -> FakeMember:
+        copy = FakeMember.__new__(FakeMember)
+        copy.id = self.id
+        copy.name = self.name
+        copy.guild = self.guild
+        copy.bot = self.bot
+        copy.activities = self.activities
+        copy._roles = set(self._roles)
+        return copy
+
+
+def make_activities(status: str) -> tuple[Any, ...]:
+    if not status:
+        return ()
+    return (discord.CustomActivity(name="Custom Status", state=status),)
+
+
+class FakeConnection:
+    def __init__(self, database: FakeDatabase) -> None:
+        self.database: FakeDatabase = database
+
+    async def _wait(self) -> None:
+        self.database.queries += 1
+        if self.database.latency:
+            await asyncio.sleep(self.database.latency)
+
+    async def fetchrow(self, query: str, *args: Any) -> Optional[dict[str, Any]]:
+        await self._wait()
+        return self.database.configs.get(args[0])
+
+    async def fetch(self, query: str, *args: Any) -> list[dict[str, Any]]:
+        # only used for the enabled guild IDs
+        await self._wait()
+        return [r for r in self.database.configs.values() if r["custom_status"]]
+
+    async def execute(self, query: str, *args: Any) -> str:
+        await self._wait()
+        return "OK"
+
+    async def copy_records_to_table(
+        self, table: str, *, records: list[Any], columns: Any = None
+    ) -> str:
+        await self._wait()
+        self.database.copied += len(records)
+        return f"COPY {len(records)}"
+
+    @contextlib.asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        # not nullcontext, that only supports async with from 3.10 on
+        yield
+
+    async def cursor(self, query: str, *args: Any, prefetch: int = 50) -> Any:
+        await self._wait()
+        for record in list(self.database.configs.values()):
+            yield record
+
+
+class FakeDatabase:
+    def __init__(self, *, latency: float = 0.0) -> None:
+        self.latency: float = latency
+        # guild_id: vanity_config row
+        self.configs: dict[int, dict[str, Any]] = {}
+        self.queries: int = 0
+        self.copied: int = 0
+
+
+class FakePool:
+    def __init__(self, database: FakeDatabase) -> None:
+        self.database: FakeDatabase = database
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, *, timeout: Optional[float] = None) -> Any:
+        yield FakeConnection(self.database)
+
+    async def fetch(self, query: str, *args: Any) -> list[Any]:
+        return await FakeConnection(self.database).fetch(query, *args)
+
+    async def fetchrow(self, query: str, *args: Any) -> Any:
+        return await FakeConnection(self.database).fetchrow(query, *args)
+
+    async def execute(self, query: str, *args: Any) -> str:
+        return await FakeConnection(self.database).execute(query, *args)
+
+    def get_size(self) -> int:
+        return 1
+
+    def get_idle_size(self) -> int:
+        return 1
+
+    def get_max_size(self) -> int:
+        return 1
+
+
+class FakeRedis:
+    def __init__(self, *, latency: float = 0.0) -> None:
+        self.latency: float = latency
+        # key: (value, expires at)
+        self.data: dict[str, tuple[Any, float]] = {}
+        # key: {field: value}
+        self.hashes: dict[str, dict[str, str]] = {}
+        self.calls: int = 0
+
+    async def _wait(self) -> None:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _live(self, key: str) -> bool:
+        entry = self.data.get(key)
+        if entry is None:
+            return False
+        if entry[1] < time.monotonic():
+            del self.data[key]
+            return False
+        return True
+
+    async def get(self, key: str) -> Any:
+        await self._wait()
+        return self.data[key][0] if self._live(key) else None
+
+    async def set(
+        self, key: str, value: Any, ex: Optional[float] = None, nx: bool = False
+    ) -> Optional[bool]:
+        await self._wait()
+        if nx and self._live(key):
+            return None
+        expires = time.monotonic() + ex if ex else float("inf")
+        self.data[key] = (value, expires)
+        return True
+
+    async def delete(self, *keys: str) -> int:
+        await self._wait()
+        removed = sum(self.data.pop(key, None) is not None for key in keys)
+        return removed + sum(self.hashes.pop(key, None) is not None for key in keys)
+
+    async def hget(self, key: str, field: str) -> Optional[str]:
+        await self._wait()
+        return self.hashes.get(key, {}).get(field)
+
+    async def hgetall(self, key: str) -> dict[str, str]:
+        await self._wait()
+        return dict(self.hashes.get(key, {}))
+
+    async def hset(
+        self,
+        key: str,
+        field: Optional[str] = None,
+        value: Optional[str] = None,
+        mapping: Optional[dict[str, str]] = None,
+    ) -> int:
+        await self._wait()
+        fields = self.hashes.setdefault(key, {})
+        if field is not None:
+            fields[field] = value  # type: ignore
+        fields.update(mapping or {})
+        return 1
+
+    async def hsetnx(self, key: str, field: str, value: str) -> int:
+        await self._wait()
+        fields = self.hashes.setdefault(key, {})
+        if field in fields:
+            return 0
+        fields[field] = value
+        return 1
+
+    async def hdel(self, key: str, *fields: str) -> int:
+        await self._wait()
+        stored = self.hashes.get(key, {})
+        return sum(stored.pop(field, None) is not None for field in fields)
+
+    async def expire(self, key: str, seconds: float) -> bool:
+        return True
+
+    async def persist(self, key: str) -> bool:
+        return True
+
+    async def rename(self, key: str, new_key: str) -> bool:
+        self.hashes[new_key] = self.hashes.pop(key)
+        return True
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis) -> None:
+        self.redis: FakeRedis = redis
+        self.commands: list[tuple[str, tuple[Any, ...], dict[str, Any]]] = []
+
+    async def __aenter__(self) -> FakePipeline:
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+    def __getattr__(self, name: str) -> Callable[..., None]:
+        def queue(*args: Any, **kwargs: Any) -> None:
+            self.commands.append((name, args, kwargs))
+
+        return queue
+
+    async def execute(self) -> list[Any]:
+        # one round trip for all of them
+        results = []
+        for name, args, kwargs in self.commands:
+            calls = self.redis.calls
+            results.append(await getattr(self.redis, name)(*args, **kwargs))
+            self.redis.calls = calls
+        self.redis.calls += 1
+        self.commands.clear()
+        return results
+
+
+class FakeHTTP:
+    def __init__(self, *, latency: float = 0.0) -> None:
+        self.latency: float = latency
+        self.calls: Counter[str] = Counter()
+
+    async def add_role(self, guild_id: int, user_id: int, role_id: int, **kwargs: Any):
+        self.calls["add_role"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def remove_role(self, guild_id: int, user_id: int, role_id: int, **kwargs: Any):
+        self.calls["remove_role"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeState:
+    """Plays the part of discord.py's ConnectionState for the gateway events we use."""
+
+    def __init__(self, bot: FakeBot) -> None:
+        self.bot: FakeBot = bot
+        self.parsers: dict[str, Callable[[dict[str, Any]], None]] = {
+            "PRESENCE_UPDATE": self.parse_presence_update,
+            "GUILD_MEMBER_ADD": self.parse_guild_member_add,
+            "GUILD_MEMBER_REMOVE": self.parse_guild_member_remove,
+        }
+
+    def _get_guild(self, guild_id: Optional[int]) -> Optional[FakeGuild]:
+        return self.bot.get_guild(guild_id)  # type: ignore
+
+    def parse_presence_update(self, data: dict[str, Any]) -> None:
+        guild = self._get_guild(int(data["guild_id"]))
+        if guild is None:
+            return
+
+        member = guild.get_member(int(data["user"]["id"]))
+        if member is None:
+            return
+
+        before = member._copy()
+        status = ""
+        for activity in data.get("activities") or ():
+            if activity.get("type") == 4:
+                status = activity.get("state") or ""
+        member.activities = make_activities(status)
+        self.bot.dispatch("presence_update", before, member)
+
+    def parse_guild_member_add(self, data: dict[str, Any]) -> None:
+        guild = self._get_guild(int(data["guild_id"]))
+        if guild is None:
+            return
+
+        member_id = int(data["user"]["id"])
+        member = guild._members[member_id] = FakeMember(member_id, guild)
+        member.bot = bool(data["user"].get("bot"))
+        self.bot.dispatch("member_join", member)
+
+    def parse_guild_member_remove(self, data: dict[str, Any]) -> None:
+        guild = self._get_guild(int(data["guild_id"]))
+        if guild is None:
+            return
+
+        member = guild._members.pop(int(data["user"]["id"]), None)
+        if member is not None:
+            self.bot.dispatch("member_remove", member)
+
+
+class FakeBot:
+    def __init__(
+        self,
+        *,
+        overrides: dict[str, Any],
+        db_latency: float = 0.0,
+        redis_latency: float = 0.0,
+        http_latency: float = 0.0,
+    ) -> None:
+        options = {k: v for k, v in vars(config).items() if not k.startswith("__")}
+        options.update(overrides)
+        self.config = SimpleNamespace(**options)
+        self.colors = Colors()
+        self.emotes = Emotes()
+        self.database = FakeDatabase(latency=db_latency)
+        self.pool = FakePool(self.database)
+        self.redis = FakeRedis(latency=redis_latency)
+        self.http = FakeHTTP(latency=http_latency)
+        self._connection = FakeState(self)
+        self.shard_ids: Optional[list[int]] = None
+        self.shard_count: Optional[int] = None
+        self.chunk_all_guilds: bool = False
+        self.started_at: float = time.perf_counter()
+        self.guilds_by_id: dict[int, FakeGuild] = {}
+        self._listeners: dict[str, list[Callable[..., Coroutine[Any, Any, Any]]]] = {}
+        self._tasks: set[asyncio.Task[None]] = set()
+        # how long dispatched listeners took
+        self.handler_times: list[float] = []
+
+    @property
+    def guilds(self) -> list[FakeGuild]:
+        return list(self.guilds_by_id.values())
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return self.guilds_by_id.get(guild_id)
+
+    def add_cog(self, cog: Any) -> None:
+        for name, method in cog.get_listeners():
+            self._listeners.setdefault(name, []).append(method)
+
+    def dispatch(self, event: str, *args: Any) -> None:
+        # like discord.py, every listener runs as its own task
+        for listener in self._listeners.get(f"on_{event}", ()):
+            task = asyncio.create_task(self._run_listener(listener, args))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_listener(self, listener: Callable[..., Any], args: Any) -> None:
+        started = time.perf_counter()
+        await listener(*args)
+        self.handler_times.append(time.perf_counter() - started)
+
+    async def wait_for_listeners(self) -> None:
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+@dataclasses.dataclass
+class Workload:
+    events: int = 100_000
+    guilds: int = 1000
+    members: int = 200
+    # how many of the guilds have a custom status set
+    configured: float = 0.1
+    # how many members start out with the vanity in their status
+    match: float = 0.2
+    # how many events change the custom status, the rest only change
+    # the online status
+    flap: float = 0.05
+    seed: int = 0
+
+    def populate(self, bot: FakeBot) -> None:
+        rng = random.Random(self.seed)
+        for guild_id in range(1, self.guilds + 1):
+            guild = FakeGuild(guild_id)
+            bot.guilds_by_id[guild_id] = guild
+            vanity = f"discord.gg/vanity{guild_id}"
+            if rng.random() < self.configured:
+                role = FakeRole(guild_id * 10)
+                guild._roles[role.id] = role
+                log_channel = FakeChannel(guild_id * 10 + 1)
+                thank_you_channel = FakeChannel(guild_id * 10 + 2)
+                guild._channels[log_channel.id] = log_channel
+                guild._channels[thank_you_channel.id] = thank_you_channel
+                bot.database.configs[guild_id] = {
+                    "guild_id": guild_id,
+                    "custom_status": vanity,
+                    "award_role_id": role.id,
+                    "thank_you_message": "Thanks {user.mention}!",
+                    "thank_you_channel_id": thank_you_channel.id,
+                    "log_channel_id": log_channel.id,
+                }
+
+            for i in range(self.members):
+                member_id = guild_id * 100_000 + i
+                has_vanity = rng.random() < self.match
+                status = f"join {vanity} today" if has_vanity else "just vibing"
+                guild._members[member_id] = FakeMember(member_id, guild, status)
+
+    def generate(self, bot: FakeBot) -> Iterator[dict[str, Any]]:
+        rng = random.Random(self.seed + 1)
+        # member_id: whether their status currently has the vanity
+        state: dict[int, bool] = {}
+        for _ in range(self.events):
+            guild_id = rng.randint(1, self.guilds)
+            member_id = guild_id * 100_000 + rng.randrange(self.members)
+            vanity = f"discord.gg/vanity{guild_id}"
+            has_vanity = state.get(member_id)
+            if has_vanity is None:
+                member = bot.guilds_by_id[guild_id]._members[member_id]
+                has_vanity = vanity in (member.activity.state if member.activity else "")
+
+            if rng.random() < self.flap:
+                has_vanity = not has_vanity
+            state[member_id] = has_vanity
+
+            status = f"join {vanity} today" if has_vanity else "just vibing"
+            yield {
+                "guild_id": str(guild_id),
+                "user": {"id": str(member_id)},
+                "status": rng.choice(("online", "idle", "dnd")),
+                "activities": [{"type": 4, "name": "Custom Status", "state": status}],
+            }
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * percentile), len(values) - 1)]
+
+
+@dataclasses.dataclass
+class Report:
+    events: int
+    elapsed: float
+    # spent settling debounced transitions and sending queued role
+    # mutations once every event was in
+    drained: float
+    parse_times: list[float]
+    handler_times: list[float]
+    stats: Counter[str]
+    role_calls: Counter[str]
+    redis_calls: int
+    db_queries: int
+    allocated_peak: Optional[int] = None
+    allocated_net: Optional[int] = None
+
+    def lines(self) -> Iterator[str]:
+        yield f"events:          {self.events}"
+        yield f"elapsed:         {self.elapsed:.3f}s"
+        yield f"events/sec:      {self.events / self.elapsed:,.0f}"
+        yield f"drained:         {self.drained:.3f}s"
+        for name, times in (("parse", self.parse_times), ("handler", self.handler_times)):
+            p50 = _percentile(times, 0.50) * 1e6
+            p99 = _percentile(times, 0.99) * 1e6
+            yield f"{name + ':':<16} {len(times)} calls, p50 {p50:.1f}us, p99 {p99:.1f}us"
+        yield f"role calls:      {dict(self.role_calls)}"
+        yield f"redis calls:     {self.redis_calls}"
+        yield f"db queries:      {self.db_queries}"
+        if self.allocated_peak is not None and self.allocated_net is not None:
+            yield f"allocated peak:  {self.allocated_peak / 1024:,.1f} KiB"
+            yield f"allocated net:   {self.allocated_net / self.events:,.1f} B/event"
+        for key, value in sorted(self.stats.items()):
+            yield f"  {key}: {value}"
+
+
+def _make_bot(
+    overrides: Optional[dict[str, Any]],
+    db_latency: float,
+    redis_latency: float,
+    http_latency: float,
+) -> FakeBot:
+    return FakeBot(
+        overrides={
+            "vanity_config_notify": False,
+            "vanity_sync_on_startup": False,
+            **(overrides or {}),
+        },
+        db_latency=db_latency,
+        redis_latency=redis_latency,
+        http_latency=http_latency,
+    )
+
+
+async def _measure(
+    bot: FakeBot,
+    records: list[Record],
+    *,
+    speed: Optional[float] = None,
+    trace_allocations: bool = False,
+) -> Report:
+    """Feeds records to the parsers, as fast as possible if ``speed`` is None."""
+
+    cog = Vanity(bot)  # type: ignore
+    await cog.cog_load()
+    await cog.configs_ready.wait()
+    bot.add_cog(cog)
+
+    # looked up after cog_load so the raw presence filter is included
+    parsers = bot._connection.parsers
+    parse_times: list[float] = []
+    perf_counter = time.perf_counter
+
+    if trace_allocations:
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+
+    first = records[0].timestamp if records else 0.0
+    started = perf_counter()
+    for i, record in enumerate(records):
+        if speed is not None:
+            delay = (record.timestamp - first) / speed - (perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif i & 255 == 0:
+            # the gateway yields to the loop between socket reads too
+            await asyncio.sleep(0)
+
+        before = perf_counter()
+        parsers[record.event](record.data)
+        parse_times.append(perf_counter() - before)
+
+    await bot.wait_for_listeners()
+    elapsed = perf_counter() - started
+
+    allocated_peak = allocated_net = None
+    if trace_allocations:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocated_peak = peak - baseline
+        allocated_net = current - baseline
+
+    # settle the transitions still waiting on their timers and send the
+    # queued role mutations, the calls they make count as well
+    drain_started = perf_counter()
+    if cog.debouncer is not None:
+        cog.debouncer.flush()
+        await cog.debouncer.join()
+    await cog.role_queue.join()
+    drained = perf_counter() - drain_started
+
+    await cog.cog_unload()
+    stats = Counter(cog.stats)
+    for component in (cog.debouncer, cog.role_queue):
+        if component is not None:
+            stats.update(component.stats)
+
+    return Report(
+        events=len(records),
+        elapsed=elapsed,
+        drained=drained,
+        parse_times=parse_times,
+        handler_times=bot.handler_times,
+        stats=stats,
+        role_calls=bot.http.calls,
+        redis_calls=bot.redis.calls,
+        db_queries=bot.database.queries,
+        allocated_peak=allocated_peak,
+        allocated_net=allocated_net,
+    )
+
+
+async def run(
+    workload: Workload,
+    *,
+    overrides: Optional[dict[str, Any]] = None,
+    trace_allocations: bool = False,
+    db_latency: float = 0.0005,
+    redis_latency: float = 0.0002,
+    http_latency: float = 0.0,
+) -> Report:
+    """Runs a synthetic workload through the Vanity cog and measures it."""
+
+    bot = _make_bot(overrides, db_latency, redis_latency, http_latency)
+    workload.populate(bot)
+    records = [Record(0.0, "PRESENCE_UPDATE", d) for d in workload.generate(bot)]
+    return await _measure(bot, records, trace_allocations=trace_allocations)
+
+
+def populate_from_recording(bot: FakeBot, records: list[Record]) -> list[Record]:
+    """Builds the guilds, members and configs a recording refers to.
+
+    Returns the records that are gateway events. Members are created with
+    the custom status of their first presence update, so that one counts
+    as unchanged, we don't know what they had before the recording.
+    """
+
+    events: list[Record] = []
+    for record in records:
+        data = record.data
+        if record.event == "VANITY_CONFIG":
+            guild = _get_or_create_guild(bot, data["guild_id"])
+            bot.database.configs[guild.id] = data
+            if data["award_role_id"] is not None:
+                guild._roles[data["award_role_id"]] = FakeRole(data["award_role_id"])
+            for key in ("log_channel_id", "thank_you_channel_id"):
+                if data[key] is not None:
+                    guild._channels[data[key]] = FakeChannel(data[key])
+            continue
+
+        events.append(record)
+        guild = _get_or_create_guild(bot, int(data["guild_id"]))
+        member_id = int(data["user"]["id"])
+        if member_id in guild._members or record.event != "PRESENCE_UPDATE":
+            # joins create their member when they're replayed
+            continue
+
+        status = ""
+        for activity in data.get("activities") or ():
+            if activity.get("type") == 4:
+                status = activity.get("state") or ""
+        member = guild._members[member_id] = FakeMember(member_id, guild, status)
+        member.bot = bool(data["user"].get("bot"))
+
+    return events
+
+
+def _get_or_create_guild(bot: FakeBot, guild_id: int) -> FakeGuild:
+    guild = bot.guilds_by_id.get(guild_id)
+    if guild is None:
+        guild = bot.guilds_by_id[guild_id] = FakeGuild(guild_id)
+    return guild
+
+
+async def replay(
+    path: Path,
+    *,
+    speed: Optional[float] = 1.0,
+    overrides: Optional[dict[str, Any]] = None,
+    trace_allocations: bool = False,
+    db_latency: float = 0.0005,
+    redis_latency: float = 0.0002,
+    http_latency: float = 0.0,
+) -> Report:
+    """Replays a recording from the debug recorder through the Vanity cog.
+
+    ``speed`` scales the recorded timing, None replays as fast as possible.
+    """
+
+    bot = _make_bot(overrides, db_latency, redis_latency, http_latency)
+    records = list(read_recording(path))
+    # a flush cancelled while stopping can land after the final one
+    records.sort(key=lambda r: r.timestamp)
+    events = populate_from_recording(bot, records)
+    return await _measure(
+        bot, events, speed=speed, trace_allocations=trace_allocations
+    )
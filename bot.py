@@ -2,12 +2,15 @@ from __future__ import annotations
 
 from cogs.utils.constants import Emotes, Colors
 from cogs.utils.context import Context
+from cogs.utils import metrics
+from cogs.utils.sweep import GuildSweeper
 from discord.ext import commands
 import discord
 import datetime
 import logging
 import aiohttp
-from typing import Any, Optional, Union
+import time
+from typing import Any, Iterator, Optional, Union
 from collections import defaultdict
 
 import config
@@ -36,6 +39,10 @@ def _prefix_callable(bot: Client, msg: discord.Message):
     return base
 
 
+def _lacks_vanity(guild: discord.Guild) -> bool:
+    return discord.utils.get(guild.features, name="VANITY_URL") is None
+
+
 class ProxyObject(discord.Object):
     def __init__(self, guild: Optional[discord.abc.Snowflake]):
         super().__init__(id=0)
@@ -49,7 +56,13 @@ class Client(commands.AutoShardedBot):
     logging_handler: Any
     bot_app_info: discord.AppInfo
 
-    def __init__(self):
+    def __init__(
+        self,
+        *,
+        shard_ids: Optional[list[int]] = None,
+        shard_count: Optional[int] = None,
+        cluster_id: Optional[int] = None,
+    ):
         allowed_mentions = discord.AllowedMentions(
             everyone=False, users=True, roles=False, replied_user=False
         )
@@ -58,17 +71,33 @@ class Client(commands.AutoShardedBot):
             members=True,
             presences=True,
         )
+        # Only guilds with a vanity config need their members, the Vanity cog
+        # chunks those itself once the bot is ready.
+        self.chunk_all_guilds: bool = getattr(config, "chunk_all_guilds", False)
         super().__init__(
             command_prefix=_prefix_callable,
             description=description,
-            chunk_guilds_at_startup=True,
+            chunk_guilds_at_startup=self.chunk_all_guilds,
             heartbeat_timeout=150.0,
             allowed_mentions=allowed_mentions,
             intents=intents,
             enable_debug_events=True,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
         )
 
         self.client_id: str = config.client_id
+        # set when running as one process of a cluster, see launcher.py
+        self.cluster_id: Optional[int] = cluster_id
+        self.metrics_server: Optional[metrics.MetricsServer] = None
+        # kept up to date by the Whitelist cog, in whitelist mode
+        self.whitelisted_guild_ids: frozenset[int] = frozenset()
+        self.sweeper = GuildSweeper(
+            self,
+            concurrency=getattr(config, "leave_concurrency", 5),
+            rate=getattr(config, "leave_rate", 40.0),
+        )
+        self.sweeper.register("only_vanity", _lacks_vanity)
 
         # shard_id: List[datetime.datetime]
         # shows the last attempted IDENTIFYs and RESUMEs
@@ -82,6 +111,18 @@ class Client(commands.AutoShardedBot):
     async def setup_hook(self) -> None:
         self.session = aiohttp.ClientSession()
 
+        metrics_port = getattr(config, "metrics_port", None)
+        if metrics_port is not None:
+            metrics.registry.register(self.collect_metrics)
+            self.metrics_server = metrics.MetricsServer(
+                host=getattr(config, "metrics_host", "127.0.0.1"),
+                port=metrics_port + (self.cluster_id or 0),
+            )
+            try:
+                await self.metrics_server.start()
+            except OSError:
+                log.exception("Failed to start the metrics server.")
+
         self.tree.interaction_check = self.interaction_check
 
         self.bot_app_info = await self.application_info()
@@ -99,6 +140,33 @@ class Client(commands.AutoShardedBot):
             except Exception:
                 log.exception("Failed to load extension %s.", extension)
 
+    def collect_metrics(self) -> Iterator[metrics.Sample]:
+        yield metrics.Sample(
+            "vanity_guilds", "gauge", "Guilds the bot is in.", {}, len(self.guilds)
+        )
+        for shard_id, latency in self.latencies:
+            yield metrics.Sample(
+                "vanity_gateway_latency_seconds",
+                "gauge",
+                "Heartbeat latency per shard.",
+                {"shard": str(shard_id)},
+                latency,
+            )
+
+        pool = self.pool
+        for name, value in (
+            ("size", pool.get_size()),
+            ("idle", pool.get_idle_size()),
+            ("max", pool.get_max_size()),
+        ):
+            yield metrics.Sample(
+                "vanity_pool_connections",
+                "gauge",
+                "asyncpg pool connections, size minus idle is what's in use.",
+                {"state": name},
+                value,
+            )
+
     @property
     def owner(self) -> discord.User:
         if self.bot_app_info.team:
@@ -178,16 +246,10 @@ class Client(commands.AutoShardedBot):
     async def on_ready(self):
         if not hasattr(self, "uptime"):
             self.uptime = discord.utils.utcnow()
+            log.info("Time to ready: %.2fs", time.perf_counter() - self.started_at)
 
             if config.only_vanity:
-                for guild in self.guilds:
-                    if discord.utils.get(guild.features, name="VANITY_URL") is None:
-                        try:
-                            await guild.leave()
-                        except Exception:
-                            log.warning(
-                                "Failed to leave guild %s: %s", guild.id, exc_info=True
-                            )
+                await self.sweeper.sweep("only_vanity")
 
         log.info("Ready: %s (ID: %s)", self.user, self.user.id)
 
@@ -204,12 +266,9 @@ class Client(commands.AutoShardedBot):
         if not self.is_ready():
             return False
 
-        if (
-            config.whitelist
-            and interaction.guild is not None
-            and not await self.redis.get(f"whitelist:{interaction.guild.id}")
-        ):
-            return False
+        if config.whitelist and interaction.guild is not None:
+            if interaction.guild.id not in self.whitelisted_guild_ids:
+                return False
 
         return True
 
@@ -238,11 +297,7 @@ class Client(commands.AutoShardedBot):
         if not config.only_vanity:
             return
 
-        has_vanity_feature = (
-            discord.utils.get(guild.features, name="VANITY_URL") is not None
-        )
-
-        if not has_vanity_feature:
+        if _lacks_vanity(guild):
             try:
                 await guild.leave()
             except Exception:
@@ -251,8 +306,11 @@ class Client(commands.AutoShardedBot):
     async def close(self) -> None:
         await super().close()
         await self.session.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
 
     async def start(self) -> None:
+        self.started_at: float = time.perf_counter()
         await super().start(config.token, reconnect=True)
 
     @property
@@ -1,8 +1,10 @@
 from .whitelist import Whitelist
+from .debug import Debug
 from bot import Client
 import config
 
 
 async def setup(bot: Client) -> None:
+    await bot.add_cog(Debug(bot))
     if config.whitelist:
         await bot.add_cog(Whitelist(bot))
@@ -0,0 +1,241 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Optional
+
+from cogs.utils import cache
+from cogs.utils.profiler import SamplingProfiler
+from cogs.utils.recorder import GatewayRecorder
+from discord.ext import commands
+from discord import app_commands
+from pathlib import Path
+import discord
+import asyncio
+import config
+
+if TYPE_CHECKING:
+    from bot import Client
+    from cogs.utils.context import Context
+
+
+class Debug(commands.Cog):
+    def __init__(self, bot: Client):
+        self.bot = bot
+        self.profiler: Optional[SamplingProfiler] = None
+        self._profile_done = asyncio.Event()
+        self.recorder: Optional[GatewayRecorder] = None
+
+    async def cog_check(self, ctx: Context) -> bool:
+        return await self.bot.is_owner(ctx.author)
+
+    async def cog_unload(self) -> None:
+        if self.profiler is not None and self.profiler.running:
+            self.profiler.stop()
+        if self.recorder is not None and self.recorder.running:
+            await self.recorder.stop()
+
+    @commands.hybrid_group(name="debug", hidden=True)
+    @app_commands.guilds(config.guild_id)
+    async def debug(self, ctx: Context) -> None:
+        """Owner only debugging commands."""
+        await ctx.show_help()
+
+    @debug.command(name="profile", hidden=True)
+    @app_commands.guilds(config.guild_id)
+    @app_commands.describe(
+        seconds="How long to profile for.",
+        interval="How many milliseconds to wait between samples.",
+    )
+    async def debug_profile(
+        self,
+        ctx: Context,
+        seconds: commands.Range[int, 1, 600] = 30,
+        interval: commands.Range[int, 1, 1000] = 5,
+    ) -> None:
+        """Sample what the event loop is doing for a while."""
+
+        if self.profiler is not None and self.profiler.running:
+            await ctx.missing("The profiler is already **running**.")
+            return
+
+        self.profiler = profiler = SamplingProfiler(interval=interval / 1000)
+        self._profile_done.clear()
+        profiler.start()
+        await ctx.neutral(
+            f"Profiling for **{seconds}** seconds...", emoji=self.bot.emotes.loading
+        )
+
+        try:
+            await asyncio.wait_for(self._profile_done.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+        result = profiler.stop()
+        timestamp = discord.utils.utcnow().strftime("%Y%m%d-%H%M%S")
+        path = Path("profiles") / f"profile-{timestamp}.folded"
+        await asyncio.get_running_loop().run_in_executor(None, result.write, path)
+
+        output = [f"{result.samples} samples over {result.duration:.1f}s"]
+        for frame, count in result.top_frames():
+            output.append(f"{count / max(result.samples, 1):>6.1%} {frame}")
+
+        text = "\n".join(output)
+        if len(text) > 1900:
+            text = text[:1900] + "\n..."
+
+        await ctx.send(f"Wrote `{path}`\n```\n{text}\n```")
+
+    @debug.command(name="stop", hidden=True)
+    @app_commands.guilds(config.guild_id)
+    async def debug_stop(self, ctx: Context) -> None:
+        """Stop the running profiler early."""
+
+        if self.profiler is None or not self.profiler.running:
+            await ctx.missing("The profiler isn't **running**.")
+            return
+
+        self._profile_done.set()
+        await ctx.approve("Stopped the **profiler**.")
+
+    @debug.command(name="caches", hidden=True)
+    @app_commands.guilds(config.guild_id)
+    async def debug_caches(self, ctx: Context) -> None:
+        """Show how the cached functions are doing."""
+
+        caches = cache.get_caches()
+        if not caches:
+            await ctx.missing("There are no **cached functions**.")
+            return
+
+        output = []
+        for name, func in sorted(caches.items()):
+            stats = func.stats
+            if stats.strategy is cache.Strategy.timed:
+                limit = f"{stats.maxsize}s ttl"
+            elif stats.strategy is cache.Strategy.lru:
+                limit = f"max {stats.maxsize}"
+            else:
+                limit = "unbounded"
+
+            output.append(
+                f"{name}\n"
+                f"  {stats.size} entries ({limit}), {stats.hit_rate:.1%} hit rate\n"
+                f"  {stats.hits} hits, {stats.misses} misses, {stats.coalesced} coalesced\n"
+                f"  {stats.evictions} evictions, {stats.invalidations} invalidations\n"
+                f"  load: mean {stats.load_mean * 1000:.1f}ms, "
+                f"p50 <{stats.load_quantile(0.5) * 1000:g}ms, "
+                f"p99 <{stats.load_quantile(0.99) * 1000:g}ms, "
+                f"max {stats.load_max * 1000:.1f}ms"
+            )
+
+        text = "\n".join(output)
+        if len(text) > 1900:
+            text = text[:1900] + "\n..."
+
+        await ctx.send(f"```\n{text}\n```")
+
+    @debug.command(name="sweep", hidden=True)
+    @app_commands.guilds(config.guild_id)
+    @app_commands.describe(
+        name="The sweep to run.",
+        dry_run="Only report which guilds would be left.",
+        force="Run it even if it already ran.",
+    )
+    async def debug_sweep(
+        self, ctx: Context, name: str, dry_run: bool = True, force: bool = False
+    ) -> None:
+        """Leave the guilds a sweep would leave, or see which those are."""
+
+        sweeper = self.bot.sweeper
+        if name not in sweeper.predicates:
+            names = ", ".join(f"`{n}`" for n in sweeper.predicates) or "none"
+            await ctx.missing(f"There's no **{name}** sweep, the sweeps are: {names}")
+            return
+
+        if not dry_run and not force and name in sweeper.reports:
+            await ctx.missing(f"The **{name}** sweep already ran, force it to run again.")
+            return
+
+        await ctx.neutral(
+            f"{'Checking' if dry_run else 'Running'} the **{name}** sweep...",
+            emoji=self.bot.emotes.loading,
+        )
+        report = await sweeper.sweep(name, dry_run=dry_run, force=force)
+        if report is None:
+            await ctx.missing(f"The **{name}** sweep already ran.")
+            return
+
+        if dry_run:
+            output = [
+                f"Would leave {len(report.guilds)} guilds, "
+                f"in about {report.estimated_duration:.1f}s"
+            ]
+            output.extend(f"{guild.id} {guild.name}" for guild in report.guilds[:25])
+            if len(report.guilds) > 25:
+                output.append(f"... and {len(report.guilds) - 25} more")
+        else:
+            output = [
+                f"Left {report.left} of {len(report.guilds)} guilds in {report.elapsed:.1f}s, "
+                f"{report.failed} failed"
+            ]
+
+        text = "\n".join(output)
+        if len(text) > 1900:
+            text = text[:1900] + "\n..."
+
+        await ctx.send(f"```\n{text}\n```")
+
+    @debug.group(name="record", hidden=True, fallback="start")
+    @app_commands.guilds(config.guild_id)
+    @app_commands.describe(
+        sample="The share of users to record events for, from 0 to 1.",
+        guild_id="Only record events from this guild.",
+    )
+    async def debug_record(
+        self,
+        ctx: Context,
+        sample: commands.Range[float, 0.0, 1.0] = 1.0,
+        guild_id: Optional[str] = None,
+    ) -> None:
+        """Record raw presence and member events to a file for replaying."""
+
+        if self.recorder is not None and self.recorder.running:
+            await ctx.missing("The recorder is already **running**.")
+            return
+
+        guild_ids = None
+        query = """SELECT * FROM vanity_config WHERE custom_status IS NOT NULL"""
+        args = ()
+        if guild_id is not None:
+            if not guild_id.isdigit():
+                await ctx.missing("That isn't a valid **guild ID**.")
+                return
+            guild_ids = {int(guild_id)}
+            query += """ AND guild_id = $1"""
+            args = (int(guild_id),)
+
+        # the replayer needs the vanity configs to make sense of the events
+        records = await self.bot.pool.fetch(query, *args)
+        header = [("VANITY_CONFIG", dict(record)) for record in records]
+
+        timestamp = discord.utils.utcnow().strftime("%Y%m%d-%H%M%S")
+        path = Path("recordings") / f"gateway-{timestamp}.jsonl.gz"
+        self.recorder = GatewayRecorder(
+            self.bot._connection.parsers, path, sample=sample, guild_ids=guild_ids
+        )
+        self.recorder.start(header)
+        await ctx.approve(f"Recording to `{path}`.")
+
+    @debug_record.command(name="stop", hidden=True)
+    @app_commands.guilds(config.guild_id)
+    async def debug_record_stop(self, ctx: Context) -> None:
+        """Stop recording gateway events."""
+
+        if self.recorder is None or not self.recorder.running:
+            await ctx.missing("The recorder isn't **running**.")
+            return
+
+        recorder = self.recorder
+        await recorder.stop()
+        await ctx.approve(
+            f"Recorded **{recorder.stats['recorded']}** of {recorder.stats['seen']} "
+            f"events over {recorder.elapsed:.0f}s to `{recorder.path}`."
+        )
@@ -1,22 +1,42 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Union
+from typing import TYPE_CHECKING, Any, Collection, Iterable, Optional, Union
 
 from cogs.utils import checks
 from discord.ext import commands, tasks
 from discord import app_commands
+from redis.exceptions import WatchError
 import discord
+import asyncio
 import datetime
+import json
+import logging
 import config
 
 if TYPE_CHECKING:
     from bot import Client
     from cogs.utils.context import Context
 
+log = logging.getLogger(__name__)
+
+# a Redis set of the whitelisted guild IDs
+WHITELIST_KEY = "whitelist"
+# changes to the set are published here, see Whitelist.update
+WHITELIST_CHANNEL = "whitelist:changes"
+
 
 class Whitelist(commands.Cog):
     def __init__(self, bot: Client):
         self.bot = bot
-        self.whitelisted_guild_ids: list[int] = []
+        self._listener_task: Optional[asyncio.Task[None]] = None
+
+    @property
+    def whitelisted_guild_ids(self) -> frozenset[int]:
+        # the snapshot lives on the bot so interaction_check can use it
+        return self.bot.whitelisted_guild_ids
+
+    @whitelisted_guild_ids.setter
+    def whitelisted_guild_ids(self, guild_ids: Iterable[int]) -> None:
+        self.bot.whitelisted_guild_ids = frozenset(guild_ids)
 
     async def fetch_whitelisted_guild_ids(self) -> list[int]:
         await self.bot.pool.execute(
@@ -26,35 +46,155 @@ class Whitelist(commands.Cog):
             self.bot.user.id,
         )
 
-        records = await self.bot.pool.fetch("SELECT guild_id FROM whitelist")
-        guild_ids: list[int] = [record["guild_id"] for record in records]
+        return await self.sync_whitelist()
 
-        for guild_id in guild_ids:
-            await self.bot.redis.set(f"whitelist:{guild_id}", 1)
+    async def sync_whitelist(self) -> list[int]:
+        """Brings the Redis set in line with PostgreSQL.
 
-        return guild_ids
+        Only the difference is written, in one MULTI. The set is watched
+        from before PostgreSQL is read, so a command changing it in the
+        meantime makes us start over instead of undoing the change.
+        """
+
+        while True:
+            async with self.bot.redis.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(WHITELIST_KEY)
+                    records = await self.bot.pool.fetch("SELECT guild_id FROM whitelist")
+                    guild_ids = {record["guild_id"] for record in records}
+                    stored = {int(member) for member in await pipe.smembers(WHITELIST_KEY)}
+
+                    missing = guild_ids - stored
+                    stale = stored - guild_ids
+                    pipe.multi()
+                    self._queue_update(pipe, missing, stale, leave=False)
+                    await pipe.execute()
+                except WatchError:
+                    continue
+
+            if missing or stale:
+                log.info(
+                    "Synced the whitelist: %s added, %s removed.", len(missing), len(stale)
+                )
+            return list(guild_ids)
 
     async def get_whitelisted_guild_ids(self) -> list[int]:
-        keys = await self.bot.redis.keys("whitelist:*")
-        guild_ids: list[int] = [int(key.decode().split(":")[1]) for key in keys]
+        members = await self.bot.redis.smembers(WHITELIST_KEY)
+        guild_ids: list[int] = [int(member) for member in members]
 
         return guild_ids
 
-    async def leave_unauthorized(self) -> None:
-        for guild in self.bot.guilds:
-            if guild.id not in self.whitelisted_guild_ids:
+    async def is_whitelisted(self, guild_id: int) -> bool:
+        return bool(await self.bot.redis.sismember(WHITELIST_KEY, str(guild_id)))
+
+    def _queue_update(
+        self, pipe: Any, added: Collection[int], removed: Collection[int], *, leave: bool
+    ) -> None:
+        if removed:
+            pipe.srem(WHITELIST_KEY, *removed)
+        if added:
+            pipe.sadd(WHITELIST_KEY, *added)
+        if added or removed:
+            message = {"added": list(added), "removed": list(removed), "leave": leave}
+            pipe.publish(WHITELIST_CHANNEL, json.dumps(message))
+
+    async def update(
+        self, *, added: Collection[int] = (), removed: Collection[int] = ()
+    ) -> None:
+        """Changes the whitelist in Redis and tells every process about it.
+
+        Processes that are in a removed guild leave it. This one does so
+        right away, the others when the message reaches them or at the
+        next hourly sync if it doesn't.
+        """
+
+        async with self.bot.redis.pipeline(transaction=True) as pipe:
+            self._queue_update(pipe, added, removed, leave=True)
+            await pipe.execute()
+
+        # don't wait for our own message
+        self.whitelisted_guild_ids = (self.whitelisted_guild_ids - set(removed)) | set(added)
+        await self.leave_guilds(set(removed) - set(added))
+
+    async def apply_update(self, data: Union[bytes, str]) -> None:
+        try:
+            message = json.loads(data)
+            added = {int(guild_id) for guild_id in message["added"]}
+            removed = {int(guild_id) for guild_id in message["removed"]}
+        except (ValueError, KeyError, TypeError):
+            log.warning("Ignoring a malformed whitelist change: %r", data)
+            return
+
+        self.whitelisted_guild_ids = (self.whitelisted_guild_ids - removed) | added
+        if message.get("leave"):
+            await self.leave_guilds(removed - added)
+
+    async def leave_guilds(self, guild_ids: Iterable[int]) -> None:
+        for guild_id in guild_ids:
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+
+            try:
                 await guild.leave()
+            except discord.NotFound:
+                # already gone, we might have left it for our own message
+                pass
+            except discord.HTTPException:
+                log.warning("Failed to leave guild %s.", guild_id, exc_info=True)
+
+    async def listen_for_changes(self) -> None:
+        # the hourly sync is only a backstop, changes arrive here right away
+        backoff = 1.0
+        while True:
+            pubsub = self.bot.redis.pubsub()
+            try:
+                await pubsub.subscribe(WHITELIST_CHANNEL)
+                # anything published before we subscribed, while starting up
+                # or disconnected, is only in the set
+                self.whitelisted_guild_ids = await self.get_whitelisted_guild_ids()
+                backoff = 1.0
+
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        await self.apply_update(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.warning(
+                    "The whitelist listener failed, retrying in %.0fs.", backoff, exc_info=True
+                )
+            finally:
+                await pubsub.aclose()
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    def is_unauthorized(self, guild: discord.Guild) -> bool:
+        return guild.id not in self.whitelisted_guild_ids
+
+    async def leave_unauthorized(self, *, force: bool = False) -> None:
+        await self.bot.sweeper.sweep("whitelist", force=force)
 
     async def cog_load(self) -> None:
         self.whitelisted_guild_ids = await self.fetch_whitelisted_guild_ids()
+        self._listener_task = asyncio.create_task(self.listen_for_changes())
+        self.bot.sweeper.register("whitelist", self.is_unauthorized)
         self.update_whitelist.start()
 
     def cog_unload(self) -> None:
         self.update_whitelist.cancel()
+        self.bot.sweeper.unregister("whitelist")
+        if self._listener_task is not None:
+            self._listener_task.cancel()
 
     @tasks.loop(hours=1)
     async def update_whitelist(self) -> None:
-        self.whitelisted_guild_ids = await self.get_whitelisted_guild_ids()
+        # also catches rows added or removed in PostgreSQL directly
+        self.whitelisted_guild_ids = await self.sync_whitelist()
+        # and leaves guilds whose removal we never heard about, the first
+        # run leaves the startup sweep to on_ready
+        await self.leave_unauthorized(force=self.update_whitelist.current_loop > 0)
 
     @update_whitelist.before_loop
     async def before_update_whitelist(self) -> None:
@@ -62,6 +202,7 @@ class Whitelist(commands.Cog):
 
     @commands.Cog.listener()
     async def on_ready(self) -> None:
+        # only the first READY sweeps, see GuildSweeper
         await self.leave_unauthorized()
 
     @commands.Cog.listener()
@@ -94,25 +235,23 @@ class Whitelist(commands.Cog):
     ) -> None:
         """Add a guild to the whitelist."""
 
-        if await self.bot.redis.get(f"whitelist:{guild}"):
-            await ctx.error(f"There's already a whitelist for `{guild}`")
-            return
-
         try:
             guild_id = int(guild)
         except ValueError:
             await ctx.error(f"Invalid guild ID: `{guild}`")
             return
 
+        if await self.is_whitelisted(guild_id):
+            await ctx.error(f"There's already a whitelist for `{guild}`")
+            return
+
         query = """
         INSERT INTO whitelist (guild_id, user_id, whitelister_id)
         VALUES ($1, $2, $3) ON CONFLICT (guild_id) DO NOTHING
         """
 
         await self.bot.pool.execute(query, guild_id, user.id, ctx.author.id)
-        await self.bot.redis.set(f"whitelist:{guild_id}", 1)
-        if guild_id not in self.whitelisted_guild_ids:
-            self.whitelisted_guild_ids.append(guild_id)
+        await self.update(added=[guild_id])
 
         await ctx.approve(f"Success, added **{guild_id}** to the whitelist")
 
@@ -129,28 +268,23 @@ class Whitelist(commands.Cog):
             await ctx.missing("You should remove the guild from another server")
             return
 
-        if not await self.bot.redis.get(f"whitelist:{guild}"):
-            await ctx.error(f"I couldn't find a whitelist for `{guild}`")
-            return
-
         try:
             guild_id = int(guild)
         except ValueError:
             await ctx.error(f"Invalid guild ID: `{guild}`")
             return
 
+        if not await self.is_whitelisted(guild_id):
+            await ctx.error(f"I couldn't find a whitelist for `{guild}`")
+            return
+
         query = """
         DELETE FROM whitelist WHERE guild_id = $1
         """
 
         await self.bot.pool.execute(query, guild_id)
-        await self.bot.redis.delete(f"whitelist:{guild_id}")
-        if guild_id in self.whitelisted_guild_ids:
-            self.whitelisted_guild_ids.pop(guild_id)
-
-        _guild = self.bot.get_guild(guild_id)
-        if _guild is not None:
-            await _guild.leave()
+        # whichever process has the guild leaves it
+        await self.update(removed=[guild_id])
 
         await ctx.approve(f"Success, removed **{guild_id}** from the whitelist")
 
@@ -178,11 +312,11 @@ class Whitelist(commands.Cog):
             await ctx.error(f"Invalid guild ID: `{new_guild}`")
             return
 
-        if await self.bot.redis.get(f"whitelist:{new_guild_id}"):
+        if await self.is_whitelisted(new_guild_id):
             await ctx.error(f"There's already a whitelist for `{new_guild_id}`")
             return
 
-        if not await self.bot.redis.get(f"whitelist:{guild_id}"):
+        if not await self.is_whitelisted(guild_id):
             await ctx.error(f"I couldn't find a whitelist for `{guild_id}`")
             return
 
@@ -192,17 +326,7 @@ class Whitelist(commands.Cog):
         """
 
         await self.bot.pool.execute(query, guild_id, new_guild_id)
-        await self.bot.redis.delete(f"whitelist:{guild_id}")
-        if guild_id in self.whitelisted_guild_ids:
-            self.whitelisted_guild_ids.remove(guild_id)
-
-        _guild = self.bot.get_guild(guild_id)
-        if _guild is not None:
-            await _guild.leave()
-
-        await self.bot.redis.set(f"whitelist:{new_guild_id}", 1)
-        if new_guild_id not in self.whitelisted_guild_ids:
-            self.whitelisted_guild_ids.append(new_guild_id)
+        await self.update(added=[new_guild_id], removed=[guild_id])
 
         await ctx.approve(
             f"Success, transferred whitelist from **{guild_id}** to **{new_guild_id}**"
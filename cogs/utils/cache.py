@@ -2,23 +2,38 @@ from __future__ import annotations
 
 import asyncio
 import enum
+import inspect
 import time
 
+from collections import OrderedDict
 from functools import wraps
-from typing import Any, Callable, Coroutine, MutableMapping, TypeVar, Protocol
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Hashable,
+    Iterator,
+    MutableMapping,
+    Optional,
+    Sized,
+    TypeVar,
+    Protocol,
+)
 
 from lru import LRU
 
+from . import metrics
+
 R = TypeVar("R")
 
 
 # Can't use ParamSpec due to https://github.com/python/typing/discussions/946
 class CacheProtocol(Protocol[R]):
-    cache: MutableMapping[str, asyncio.Task[R]]
+    cache: MutableMapping[Hashable, asyncio.Task[R]]
 
     def __call__(self, *args: Any, **kwds: Any) -> asyncio.Task[R]: ...
 
-    def get_key(self, *args: Any, **kwargs: Any) -> str: ...
+    def get_key(self, *args: Any, **kwargs: Any) -> Hashable: ...
 
     def invalidate(self, *args: Any, **kwargs: Any) -> bool: ...
 
@@ -26,44 +41,191 @@ class CacheProtocol(Protocol[R]):
 
     def get_stats(self) -> tuple[int, int]: ...
 
-
-class ExpiringCache(dict):
-    def __init__(self, seconds: float):
-        self.__ttl: float = seconds
-        super().__init__()
-
-    def __verify_cache_integrity(self):
-        # Have to do this in two steps...
-        current_time = time.monotonic()
-        to_remove = [
-            k for (k, (v, t)) in super().items() if current_time > (t + self.__ttl)
-        ]
-        for k in to_remove:
-            del self[k]
-
-    def __contains__(self, key: str):
-        self.__verify_cache_integrity()
-        return super().__contains__(key)
-
-    def __getitem__(self, key: str):
-        self.__verify_cache_integrity()
-        v, _ = super().__getitem__(key)
-        return v
-
-    def get(self, key: str, default: Any = None):
-        v = super().get(key, default)
-        if v is default:
-            return default
-        return v[0]  # type: ignore
-
-    def __setitem__(self, key: str, value: Any):
-        super().__setitem__(key, (value, time.monotonic()))
-
-    def values(self):
-        return map(lambda x: x[0], super().values())
-
-    def items(self):
-        return map(lambda x: (x[0], x[1][0]), super().items())
+    stats: CacheStats
+
+
+load_latency = metrics.registry.histogram(
+    "cache_load_seconds", "Time cached functions took on a miss.", ("cache",)
+)
+
+
+class CacheStats:
+    """What a cached function's cache has been up to.
+
+    A hit on a call that is still running is also counted as coalesced,
+    the caller shared the pending task instead of running its own.
+    """
+
+    __slots__ = (
+        "name",
+        "strategy",
+        "maxsize",
+        "hits",
+        "misses",
+        "coalesced",
+        "_evictions",
+        "invalidations",
+        "load_time",
+        "load_max",
+        "_cache",
+    )
+
+    def __init__(
+        self, name: str, strategy: Strategy, maxsize: int, cache: Sized
+    ) -> None:
+        self.name: str = name
+        self.strategy: Strategy = strategy
+        # seconds for the timed strategy
+        self.maxsize: int = maxsize
+        self.hits: int = 0
+        self.misses: int = 0
+        self.coalesced: int = 0
+        self._evictions: int = 0
+        self.invalidations: int = 0
+        # total and slowest seconds spent loading, the distribution is in
+        # the load_latency histogram
+        self.load_time: float = 0.0
+        self.load_max: float = 0.0
+        # only its size and evictions are read
+        self._cache: Sized = cache
+
+    @property
+    def size(self) -> int:
+        return len(self._cache)
+
+    @property
+    def evictions(self) -> int:
+        # ExpiringCache counts its own
+        return self._evictions + getattr(self._cache, "evictions", 0)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def load_mean(self) -> float:
+        return self.load_time / self.misses if self.misses else 0.0
+
+    def load_quantile(self, quantile: float) -> float:
+        return load_latency.quantile(quantile, self.name)
+
+    def _observe_load(self, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        self.load_time += elapsed
+        if elapsed > self.load_max:
+            self.load_max = elapsed
+        load_latency.observe(elapsed, self.name)
+
+
+# name: cached function, every function decorated with cache()
+_registry: dict[str, CacheProtocol[Any]] = {}
+
+
+def get_caches() -> dict[str, CacheProtocol[Any]]:
+    return dict(_registry)
+
+
+def collect_metrics() -> Iterator[metrics.Sample]:
+    for name, func in _registry.items():
+        stats = func.stats
+        labels = {"cache": name}
+        counters = {
+            "hit": stats.hits,
+            "miss": stats.misses,
+            "coalesced": stats.coalesced,
+            "eviction": stats.evictions,
+            "invalidation": stats.invalidations,
+        }
+        yield from metrics.counter_samples(
+            "cache_events_total",
+            "Cached function lookups and evictions.",
+            counters,
+            label="event",
+            **labels,
+        )
+        yield metrics.Sample(
+            "cache_size", "gauge", "Entries in a cached function's cache.", labels, stats.size
+        )
+
+
+metrics.registry.register(collect_metrics)
+
+
+class ExpiringCache(MutableMapping[Any, Any]):
+    """A mapping whose entries expire ``seconds`` after they were last set.
+
+    Entries are kept in the order they were set, which is also the order
+    they expire in, so every access only has to drop the expired entries
+    off the front instead of scanning the whole cache. If ``maxsize`` is
+    given the oldest entries are evicted to stay within it.
+    """
+
+    def __init__(self, seconds: float, maxsize: Optional[int] = None):
+        self.ttl: float = seconds
+        self.maxsize: Optional[int] = maxsize
+        # key: (value, time it was set)
+        self._data: OrderedDict[Any, tuple[Any, float]] = OrderedDict()
+        # entries that expired or were pushed out by maxsize
+        self.evictions: int = 0
+
+    def _expire(self) -> float:
+        now = time.monotonic()
+        data = self._data
+        cutoff = now - self.ttl
+        while data:
+            key = next(iter(data))
+            if data[key][1] >= cutoff:
+                break
+            del data[key]
+            self.evictions += 1
+        return now
+
+    def __contains__(self, key: Any) -> bool:
+        self._expire()
+        return key in self._data
+
+    def __getitem__(self, key: Any) -> Any:
+        self._expire()
+        return self._data[key][0]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        now = self._expire()
+        data = self._data
+        if key in data:
+            # it expires last now
+            data.move_to_end(key)
+        data[key] = (value, now)
+        if self.maxsize is not None and len(data) > self.maxsize:
+            data.popitem(last=False)
+            self.evictions += 1
+
+    def __delitem__(self, key: Any) -> None:
+        self._expire()
+        del self._data[key]
+
+    def __iter__(self) -> Iterator[Any]:
+        self._expire()
+        # a snapshot, entries can expire while the caller is iterating
+        return iter(list(self._data))
+
+    def __len__(self) -> int:
+        self._expire()
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"<ExpiringCache ttl={self.ttl} size={len(self)}>"
+
+    def values(self) -> list[Any]:
+        self._expire()
+        return [v for v, _ in self._data.values()]
+
+    def items(self) -> list[tuple[Any, Any]]:
+        self._expire()
+        return [(k, v) for k, (v, _) in self._data.items()]
+
+    def clear(self) -> None:
+        self._data.clear()
 
 
 class Strategy(enum.Enum):
@@ -72,39 +234,75 @@ class Strategy(enum.Enum):
     timed = 3
 
 
+# separates the positional arguments from the keyword ones in keys
+_KWARGS_MARK = object()
+# marks the string keys used for calls with unhashable arguments
+_UNHASHABLE = object()
+# single arguments of these types are used as the key as they are,
+# they can't be mistaken for a tuple key
+_PLAIN_KEY_TYPES = frozenset({int, str})
+# I want to pass asyncpg.Connection objects to the parameters however, I do
+# not care what connection is passed in
+_IGNORED_KWARGS = frozenset({"connection", "pool"})
+
+
+def _true_repr(o: Any) -> str:
+    # we do care what 'self' parameter is when we __repr__ it
+    if o.__class__.__repr__ is object.__repr__:
+        return f"<{o.__class__.__module__}.{o.__class__.__name__}>"
+    return repr(o)
+
+
 def cache(
     maxsize: int = 128,
     strategy: Strategy = Strategy.lru,
     ignore_kwargs: bool = False,
 ) -> Callable[[Callable[..., Coroutine[Any, Any, R]]], CacheProtocol[R]]:
     def decorator(func: Callable[..., Coroutine[Any, Any, R]]) -> CacheProtocol[R]:
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        def _on_evict(key: Any, value: Any) -> None:
+            stats._evictions += 1
+
         if strategy is Strategy.lru:
-            _internal_cache = LRU(maxsize)
-            _stats = _internal_cache.get_stats
+            _internal_cache = LRU(maxsize, callback=_on_evict)
         elif strategy is Strategy.raw:
             _internal_cache = {}
-            _stats = lambda: (0, 0)
         elif strategy is Strategy.timed:
             _internal_cache = ExpiringCache(maxsize)
-            _stats = lambda: (0, 0)
-
-        def _make_key(args: tuple[Any, ...], kwargs: dict[str, Any]) -> str:
-            # this is a bit of a cluster fuck
-            # we do care what 'self' parameter is when we __repr__ it
-            def _true_repr(o):
-                if o.__class__.__repr__ is object.__repr__:
-                    return f"<{o.__class__.__module__}.{o.__class__.__name__}>"
-                return repr(o)
-
-            key = [f"{func.__module__}.{func.__name__}"]
-            key.extend(_true_repr(o) for o in args)
+
+        stats = CacheStats(name, strategy, maxsize, _internal_cache)
+
+        # methods share one cache across instances, so self isn't part of the key
+        parameters = list(inspect.signature(func).parameters)
+        offset = 1 if parameters and parameters[0] in ("self", "cls") else 0
+        prefix = f"{func.__module__}.{func.__name__}"
+
+        # tuple keys end with the type of every value, so 1, 1.0 and True
+        # don't share an entry like they would by equality alone
+        def _make_key(args: tuple[Any, ...], kwargs: dict[str, Any]) -> Hashable:
+            positional = args[offset:] if offset else args
+            if kwargs and not ignore_kwargs:
+                extra = tuple(i for i in kwargs.items() if i[0] not in _IGNORED_KWARGS)
+                if extra:
+                    return (
+                        *positional,
+                        _KWARGS_MARK,
+                        *extra,
+                        *map(type, positional),
+                        *(type(v) for _, v in extra),
+                    )
+
+            if len(positional) == 1 and type(positional[0]) in _PLAIN_KEY_TYPES:
+                return positional[0]
+            return (*positional, *map(type, positional))
+
+        def _make_string_key(args: tuple[Any, ...], kwargs: dict[str, Any]) -> str:
+            key = [prefix]
+            key.extend(_true_repr(o) for o in args[offset:])
             if not ignore_kwargs:
                 for k, v in kwargs.items():
-                    # note: this only really works for this use case in particular
-                    # I want to pass asyncpg.Connection objects to the parameters
-                    # however, they use default __repr__ and I do not care what
-                    # connection is passed in, so I needed a bypass.
-                    if k == "connection" or k == "pool":
+                    if k in _IGNORED_KWARGS:
                         continue
 
                     key.append(_true_repr(k))
@@ -112,41 +310,92 @@ def cache(
 
             return ":".join(key)
 
+        def _get_key(args: tuple[Any, ...], kwargs: dict[str, Any]) -> Hashable:
+            key = _make_key(args, kwargs)
+            try:
+                hash(key)
+            except TypeError:
+                return (_UNHASHABLE, _make_string_key(args, kwargs))
+            return key
+
+        def _key_to_string(key: Hashable) -> str:
+            if type(key) is not tuple:
+                return f"{prefix}:{_true_repr(key)}"
+            if key and key[0] is _UNHASHABLE:
+                return key[1]
+
+            # the types make up the second half, past the mark if there is one
+            keywords = any(part is _KWARGS_MARK for part in key)
+            values = key[: len(key) // 2 + keywords]
+            parts = [prefix]
+            keywords = False
+            for part in values:
+                if part is _KWARGS_MARK:
+                    keywords = True
+                elif keywords:
+                    parts.extend((_true_repr(part[0]), _true_repr(part[1])))
+                else:
+                    parts.append(_true_repr(part))
+            return ":".join(parts)
+
+        def _load(key: Hashable, args: tuple[Any, ...], kwargs: dict[str, Any]):
+            stats.misses += 1
+            started = time.perf_counter()
+            _internal_cache[key] = task = asyncio.create_task(func(*args, **kwargs))
+            task.add_done_callback(lambda _: stats._observe_load(started))
+            return task
+
         @wraps(func)
         def wrapper(*args: Any, **kwargs: Any):
             key = _make_key(args, kwargs)
             try:
                 task = _internal_cache[key]
             except KeyError:
-                _internal_cache[key] = task = asyncio.create_task(func(*args, **kwargs))
-                return task
-            else:
-                return task
+                return _load(key, args, kwargs)
+            except TypeError:
+                # unhashable arguments, fall back to a string key
+                key = (_UNHASHABLE, _make_string_key(args, kwargs))
+                try:
+                    task = _internal_cache[key]
+                except KeyError:
+                    return _load(key, args, kwargs)
+
+            stats.hits += 1
+            if not task.done():
+                stats.coalesced += 1
+            return task
 
         def _invalidate(*args: Any, **kwargs: Any) -> bool:
             try:
-                del _internal_cache[_make_key(args, kwargs)]
+                del _internal_cache[_get_key(args, kwargs)]
             except KeyError:
                 return False
             else:
+                stats.invalidations += 1
                 return True
 
         def _invalidate_containing(key: str) -> None:
+            # matched against the same "module.func:arg:arg" strings the keys
+            # used to be
             to_remove = []
             for k in _internal_cache.keys():
-                if key in k:
+                if key in _key_to_string(k):
                     to_remove.append(k)
             for k in to_remove:
                 try:
                     del _internal_cache[k]
                 except KeyError:
                     continue
+                else:
+                    stats.invalidations += 1
 
         wrapper.cache = _internal_cache  # type: ignore
-        wrapper.get_key = lambda *args, **kwargs: _make_key(args, kwargs)  # type: ignore
+        wrapper.get_key = lambda *args, **kwargs: _get_key(args, kwargs)  # type: ignore
         wrapper.invalidate = _invalidate  # type: ignore
-        wrapper.get_stats = _stats  # type: ignore
+        wrapper.get_stats = lambda: (stats.hits, stats.misses)  # type: ignore
+        wrapper.stats = stats  # type: ignore
         wrapper.invalidate_containing = _invalidate_containing  # type: ignore
+        _registry[name] = wrapper  # type: ignore
         return wrapper  # type: ignore
 
     return decorator
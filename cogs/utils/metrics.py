@@ -0,0 +1,243 @@
+from __future__ import annotations
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Iterable,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    Optional,
+    TypeVar,
+)
+
+from functools import wraps
+from aiohttp import web
+import bisect
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+
+class Sample(NamedTuple):
+    name: str
+    kind: str  # counter or gauge
+    documentation: str
+    labels: Mapping[str, str]
+    value: float
+
+
+def counter_samples(
+    name: str,
+    documentation: str,
+    counts: Mapping[str, int],
+    *,
+    label: str,
+    **labels: str,
+) -> Iterator[Sample]:
+    """Turns one of the ``stats`` counters the cogs keep into samples."""
+    for key, value in counts.items():
+        yield Sample(name, "counter", documentation, {**labels, label: key}, value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Mapping[str, str]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """A Prometheus style histogram, observing is a bisect and two additions."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.label_names: tuple[str, ...] = label_names
+        self.buckets: tuple[float, ...] = buckets
+        # label values: [count per bucket..., +Inf count, sum]
+        self._series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def quantile(self, quantile: float, *labels: str) -> float:
+        """The upper bound of the bucket the quantile falls in."""
+        series = self._series.get(labels)
+        if series is None:
+            return 0.0
+
+        counts = series[:-1]
+        target = quantile * sum(counts)
+        total = 0
+        for bound, count in zip((*self.buckets, float("inf")), counts):
+            total += count
+            if total >= target and total:
+                return bound
+        return 0.0
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for values, series in self._series.items():
+            labels = dict(zip(self.label_names, values))
+            total = 0
+            for bound, count in zip((*self.buckets, float("inf")), series):
+                total += count
+                le = _format_labels({**labels, "le": _format_value(bound)})
+                yield f"{self.name}_bucket{le} {total}"
+            yield f"{self.name}_sum{_format_labels(labels)} {series[-1]}"
+            yield f"{self.name}_count{_format_labels(labels)} {total}"
+
+
+class Registry:
+    """Everything that ends up on the metrics endpoint.
+
+    Histograms are updated as things happen, everything else is read
+    from collectors only when the endpoint is scraped.
+    """
+
+    def __init__(self) -> None:
+        self._histograms: list[Histogram] = []
+        self._collectors: list[Callable[[], Iterable[Sample]]] = []
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        histogram = Histogram(name, documentation, label_names, buckets)
+        self._histograms.append(histogram)
+        return histogram
+
+    def register(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        self._collectors.append(collector)
+
+    def unregister(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        try:
+            self._collectors.remove(collector)
+        except ValueError:
+            pass
+
+    def render(self) -> str:
+        lines: list[str] = []
+        seen: set[str] = set()
+        samples: list[Sample] = []
+        for collector in self._collectors:
+            try:
+                samples.extend(collector())
+            except Exception:
+                log.exception("Metrics collector %r failed.", collector)
+
+        samples.sort(key=lambda s: s.name)
+        for sample in samples:
+            if sample.name not in seen:
+                seen.add(sample.name)
+                lines.append(f"# HELP {sample.name} {sample.documentation}")
+                lines.append(f"# TYPE {sample.name} {sample.kind}")
+            labels = _format_labels(sample.labels)
+            lines.append(f"{sample.name}{labels} {_format_value(sample.value)}")
+
+        for histogram in self._histograms:
+            lines.extend(histogram.render())
+
+        lines.append("")
+        return "\n".join(lines)
+
+
+registry = Registry()
+
+listener_latency = registry.histogram(
+    "vanity_listener_seconds", "Time spent in event listeners.", ("listener",)
+)
+redis_latency = registry.histogram(
+    "vanity_redis_seconds", "Latency of Redis commands.", ("command",)
+)
+
+
+CoroFunc = Callable[..., Coroutine[Any, Any, R]]
+
+
+def timed(histogram: Histogram, *labels: str) -> Callable[[CoroFunc[R]], CoroFunc[R]]:
+    def decorator(func: CoroFunc[R]) -> CoroFunc[R]:
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> R:
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsServer:
+    """Serves the registry in the Prometheus text format on ``/metrics``."""
+
+    def __init__(self, *, host: str = "127.0.0.1", port: int = 9100) -> None:
+        self.host: str = host
+        self.port: int = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        log.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=registry.render(), content_type="text/plain", charset="utf-8"
+        )
@@ -0,0 +1,30 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict
+
+# discord.py hands every gateway payload to ConnectionState.parsers[event],
+# these put our own functions in front of those. A wrapper has to call the
+# next parser through its own ``original`` attribute rather than a captured
+# variable, so that the wrappers can be taken out in any order.
+
+Parser = Callable[[Dict[str, Any]], None]
+
+
+def install_parser(parsers: dict[str, Parser], event: str, parser: Parser) -> None:
+    parser.original = parsers[event]
+    parsers[event] = parser
+
+
+def uninstall_parser(parsers: dict[str, Parser], event: str, parser: Parser) -> None:
+    original = parser.original
+    current = parsers.get(event)
+    if current is parser:
+        parsers[event] = original
+        return
+
+    # something wrapped us since, unlink us from under it
+    while current is not None:
+        inner = getattr(current, "original", None)
+        if inner is parser:
+            current.original = original
+            return
+        current = inner
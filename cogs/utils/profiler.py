@@ -0,0 +1,120 @@
+from __future__ import annotations
+from typing import Optional
+
+from collections import Counter
+from pathlib import Path
+import os
+import signal
+import sys
+import threading
+import time
+
+
+def _describe(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileResult:
+    def __init__(self, stacks: Counter[str], samples: int, duration: float) -> None:
+        # root;...;leaf: count
+        self.stacks: Counter[str] = stacks
+        self.samples: int = samples
+        self.duration: float = duration
+
+    def top_frames(self, limit: int = 10) -> list[tuple[str, int]]:
+        """The frames that were running (not waiting on a callee) the most."""
+        leaves: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(limit)
+
+    def write(self, path: Path) -> None:
+        # collapsed stacks, the input format of flamegraph.pl, speedscope and co.
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fp:
+            for stack, count in self.stacks.items():
+                fp.write(f"{stack} {count}\n")
+
+
+class SamplingProfiler:
+    """Samples the stack of the main thread.
+
+    Where available a CPU time interval timer (SIGPROF) interrupts the
+    main thread every ``interval`` seconds of CPU time and the signal
+    handler records the stack it landed in, so time spent idle waiting
+    for the gateway doesn't show up.
+
+    Elsewhere a background thread samples the stack instead, which is
+    biased towards the points where the main thread releases the GIL.
+    """
+
+    def __init__(self, *, interval: float = 0.005) -> None:
+        self.interval: float = interval
+        self.thread_id: int = threading.main_thread().ident  # type: ignore
+        self.uses_signal: bool = hasattr(signal, "setitimer")
+        self.running: bool = False
+        self._stacks: Counter[str] = Counter()
+        self._samples: int = 0
+        # code object: description, the same functions show up over and over
+        self._names: dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started_at: float = 0.0
+
+    def start(self) -> None:
+        if self.running:
+            raise RuntimeError("The profiler is already running.")
+
+        self._stacks.clear()
+        self._samples = 0
+        self._started_at = time.perf_counter()
+        self.running = True
+        if self.uses_signal:
+            # has to be called from the main thread
+            signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="sampling-profiler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> ProfileResult:
+        if self.uses_signal:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        else:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+
+        self.running = False
+        duration = time.perf_counter() - self._started_at
+        return ProfileResult(Counter(self._stacks), self._samples, duration)
+
+    def _record(self, frame) -> None:
+        names = self._names
+        parts: list[str] = []
+        while frame is not None:
+            code = frame.f_code
+            name = names.get(code)
+            if name is None:
+                name = names[code] = _describe(code)
+            parts.append(name)
+            frame = frame.f_back
+
+        parts.reverse()
+        self._stacks[";".join(parts)] += 1
+        self._samples += 1
+
+    def _on_signal(self, signum, frame) -> None:
+        self._record(frame)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self._record(frame)
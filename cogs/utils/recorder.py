@@ -0,0 +1,148 @@
+from __future__ import annotations
+from typing import Any, Iterable, Iterator, Optional
+
+from .parsers import Parser, install_parser, uninstall_parser
+from collections import Counter
+from pathlib import Path
+import asyncio
+import gzip
+import json
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+RECORDED_EVENTS = ("PRESENCE_UPDATE", "GUILD_MEMBER_ADD", "GUILD_MEMBER_REMOVE")
+
+
+class Record:
+    __slots__ = ("timestamp", "event", "data")
+
+    def __init__(self, timestamp: float, event: str, data: dict[str, Any]) -> None:
+        self.timestamp: float = timestamp
+        self.event: str = event
+        self.data: dict[str, Any] = data
+
+
+def read_recording(path: Path) -> Iterator[Record]:
+    """Reads back a recording, in the order it was written."""
+    with gzip.open(path, "rt", encoding="utf-8") as fp:
+        for line in fp:
+            if line.strip():
+                entry = json.loads(line)
+                yield Record(entry["t"], entry["op"], entry["d"])
+
+
+class GatewayRecorder:
+    """Appends raw gateway payloads to a gzipped JSON lines file.
+
+    Every line is ``{"t": unix time, "op": event name, "d": payload}``.
+    Payloads are taken straight from the socket before any of discord.py's
+    parsing (or our own filters) runs. ``sample`` keeps that share of
+    users, all of their events or none, and ``guild_ids`` limits the
+    recording to those guilds. Lines are buffered and written from a
+    thread every ``flush_interval`` seconds, each flush appending a new
+    gzip member so the file stays readable if the process dies.
+    """
+
+    def __init__(
+        self,
+        parsers: dict[str, Parser],
+        path: Path,
+        *,
+        sample: float = 1.0,
+        guild_ids: Optional[set[int]] = None,
+        flush_interval: float = 1.0,
+    ) -> None:
+        self.parsers: dict[str, Parser] = parsers
+        self.path: Path = path
+        self.sample: float = sample
+        self.guild_ids: Optional[set[int]] = guild_ids
+        self.flush_interval: float = flush_interval
+        self.stats: Counter[str] = Counter()
+        self._buffer: list[str] = []
+        # event: our wrapper
+        self._hooks: dict[str, Parser] = {}
+        self._flush_task: Optional[asyncio.Task[None]] = None
+        # a cancelled flush keeps writing in its thread
+        self._write_lock = threading.Lock()
+        self._started_at: float = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._hooks)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started_at
+
+    def _keep(self, data: dict[str, Any]) -> bool:
+        if self.guild_ids is not None and int(data["guild_id"]) not in self.guild_ids:
+            return False
+        if self.sample >= 1.0:
+            return True
+        # by the creation time part of the snowflake, the low bits are mostly 0
+        user_id = int(data["user"]["id"])
+        return (user_id >> 22) % 10_000 < self.sample * 10_000
+
+    def _make_hook(self, event: str) -> Parser:
+        def record(data: dict[str, Any]) -> None:
+            self.stats["seen"] += 1
+            if self._keep(data):
+                self.stats["recorded"] += 1
+                self.add(event, data)
+            record.original(data)
+
+        return record
+
+    def add(self, event: str, data: dict[str, Any]) -> None:
+        # serialized right away, discord.py is free to hold on to the payload
+        entry = {"t": time.time(), "op": event, "d": data}
+        self._buffer.append(json.dumps(entry, separators=(",", ":")))
+
+    def start(self, header: Iterable[tuple[str, dict[str, Any]]] = ()) -> None:
+        """Starts recording, ``header`` entries are written first."""
+        if self.running:
+            raise RuntimeError("The recorder is already running.")
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        for event, data in header:
+            self.add(event, data)
+
+        for event in RECORDED_EVENTS:
+            hook = self._hooks[event] = self._make_hook(event)
+            install_parser(self.parsers, event, hook)
+
+        self._started_at = time.monotonic()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        for event, hook in self._hooks.items():
+            uninstall_parser(self.parsers, event, hook)
+        self._hooks.clear()
+
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+
+        lines, self._buffer = self._buffer, []
+        await asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+        self.stats["written"] += len(lines)
+
+    def _write(self, lines: list[str]) -> None:
+        with self._write_lock, gzip.open(self.path, "at", encoding="utf-8") as fp:
+            fp.write("\n".join(lines) + "\n")
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Failed to write to %s.", self.path)
@@ -0,0 +1,154 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Callable, Optional
+
+from collections import Counter
+from discord.ext import commands
+import discord
+import asyncio
+import logging
+import time
+
+if TYPE_CHECKING:
+    from bot import Client
+
+log = logging.getLogger(__name__)
+
+# which guilds a sweep should leave
+Predicate = Callable[[discord.Guild], bool]
+
+
+class SweepReport:
+    def __init__(self, name: str, guilds: list[discord.Guild], *, dry_run: bool) -> None:
+        self.name: str = name
+        self.guilds: list[discord.Guild] = guilds
+        self.dry_run: bool = dry_run
+        self.estimated_duration: float = 0.0
+        self.left: int = 0
+        self.failed: int = 0
+        self.started_at: float = time.monotonic()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished_at or time.monotonic()
+        return end - self.started_at
+
+
+class GuildSweeper:
+    """Leaves the guilds that match a named predicate.
+
+    Up to ``concurrency`` leaves are in flight at once and they are paced
+    to ``rate`` per second, under the global rate limit every request
+    counts towards. Each sweep runs at most once per process unless it
+    is forced, so a READY fired by a reconnect doesn't start it again. A
+    dry run only reports what would be left and an estimate of how long
+    that would take.
+    """
+
+    def __init__(self, bot: Client, *, concurrency: int = 5, rate: float = 40.0) -> None:
+        self.bot: Client = bot
+        self.concurrency: int = concurrency
+        self.rate: float = rate
+        # name: Predicate
+        self.predicates: dict[str, Predicate] = {}
+        # name: the last finished sweep
+        self.reports: dict[str, SweepReport] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        # shared by every sweep, they all count towards the same limit
+        self._bucket = commands.Cooldown(max(int(rate), 1), max(int(rate), 1) / rate)
+        # seconds a leave takes, assumed until we've seen some
+        self._latency: float = 0.25
+        self.stats: Counter[str] = Counter()
+
+    def register(self, name: str, predicate: Predicate) -> None:
+        self.predicates[name] = predicate
+
+    def unregister(self, name: str) -> None:
+        self.predicates.pop(name, None)
+
+    def estimate(self, count: int) -> float:
+        per_second = min(self.rate, self.concurrency / self._latency)
+        return count / per_second
+
+    async def sweep(
+        self, name: str, *, dry_run: bool = False, force: bool = False
+    ) -> Optional[SweepReport]:
+        """Runs a sweep, returns None if it already ran and isn't forced."""
+
+        predicate = self.predicates[name]
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            if not dry_run and not force and name in self.reports:
+                return None
+
+            guilds = [guild for guild in self.bot.guilds if predicate(guild)]
+            report = SweepReport(name, guilds, dry_run=dry_run)
+            report.estimated_duration = self.estimate(len(guilds))
+            if dry_run:
+                report.finished_at = report.started_at
+                return report
+
+            if guilds:
+                log.info(
+                    "Leaving %s guilds for the %s sweep, about %.0fs.",
+                    len(guilds),
+                    name,
+                    report.estimated_duration,
+                )
+                await self._run(report)
+
+            report.finished_at = time.monotonic()
+            self.reports[name] = report
+            if guilds:
+                log.info(
+                    "Finished the %s sweep: left %s, %s failed, in %.1fs.",
+                    name,
+                    report.left,
+                    report.failed,
+                    report.elapsed,
+                )
+            return report
+
+    async def _run(self, report: SweepReport) -> None:
+        queue: asyncio.Queue[discord.Guild] = asyncio.Queue()
+        for guild in report.guilds:
+            queue.put_nowait(guild)
+
+        workers = [
+            asyncio.create_task(self._worker(queue, report))
+            for _ in range(min(self.concurrency, len(report.guilds)))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _wait_for_bucket(self) -> None:
+        while True:
+            retry_after = self._bucket.update_rate_limit()
+            if retry_after is None:
+                return
+            self.stats["paced"] += 1
+            await asyncio.sleep(retry_after)
+
+    async def _worker(self, queue: asyncio.Queue[discord.Guild], report: SweepReport) -> None:
+        while not queue.empty():
+            guild = queue.get_nowait()
+            await self._wait_for_bucket()
+            started = time.monotonic()
+            try:
+                await guild.leave()
+            except discord.NotFound:
+                # already gone
+                report.left += 1
+            except Exception:
+                report.failed += 1
+                self.stats["failed"] += 1
+                log.warning("Failed to leave guild %s.", guild.id, exc_info=True)
+            else:
+                report.left += 1
+                self.stats["left"] += 1
+
+            # smoothed, for the estimates
+            self._latency = self._latency * 0.9 + (time.monotonic() - started) * 0.1
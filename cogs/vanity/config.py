@@ -1,10 +1,12 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING, Any, Optional
 
+from .matcher import MatchMode, compile_matcher
 import discord
 
 if TYPE_CHECKING:
     from bot import Client
+    from .matcher import Matcher
 
 
 class VanityConfig:
@@ -15,6 +17,7 @@ class VanityConfig:
         "thank_you_message",
         "thank_you_channel_id",
         "log_channel_id",
+        "matches",
         "bot",
     )
 
@@ -25,6 +28,7 @@ class VanityConfig:
     thank_you_message: Optional[str]
     thank_you_channel_id: Optional[int]
     log_channel_id: Optional[int]
+    matches: Matcher
 
     @classmethod
     def from_record(cls, record: Any, bot: Client):
@@ -37,6 +41,9 @@ class VanityConfig:
         self.thank_you_message = record["thank_you_message"]
         self.thank_you_channel_id = record["thank_you_channel_id"]
         self.log_channel_id = record["log_channel_id"]
+        self.matches = compile_matcher(
+            self.custom_status, MatchMode.from_config(bot.config)
+        )
 
         return self
 
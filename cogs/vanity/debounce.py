@@ -0,0 +1,169 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Callable, Coroutine, Optional, Tuple
+
+from collections import Counter
+import asyncio
+import heapq
+import itertools
+import logging
+
+if TYPE_CHECKING:
+    import discord
+
+log = logging.getLogger(__name__)
+
+# (guild_id, member_id)
+Key = Tuple[int, int]
+
+
+class _Pending:
+    __slots__ = ("settled", "current", "member", "deadline")
+
+    def __init__(self, settled: bool, current: bool, member: discord.Member) -> None:
+        # whether the member had the vanity before this burst of changes
+        self.settled: bool = settled
+        self.current: bool = current
+        self.member: discord.Member = member
+        self.deadline: float = 0.0
+
+
+def _cost(removed: bool) -> int:
+    # log + role removal, or log + thank you + role add
+    return 2 if removed else 3
+
+
+class PresenceDebouncer:
+    """Collapses a member's vanity transitions into their net transition.
+
+    Every change restarts the member's timer, once it runs out without
+    further changes the callback is called with the latest member object
+    if their state differs from the one they had before the burst.
+    Losing the vanity waits an extra grace period so briefly clearing the
+    status doesn't cost a role removal and re-add.
+
+    All deadlines live in one heap served by a single loop timer.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[discord.Member, bool], Coroutine[Any, Any, None]],
+        *,
+        window: float,
+        grace: float,
+    ) -> None:
+        self.callback = callback
+        self.window: float = window
+        self.grace: float = grace
+        self._pending: dict[Key, _Pending] = {}
+        self._heap: list[tuple[float, int, Key]] = []
+        self._counter = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_deadline: float = float("inf")
+        self._tasks: set[asyncio.Task[None]] = set()
+        self.stats: Counter[str] = Counter()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def submit(self, member: discord.Member, before: bool, after: bool) -> None:
+        key = (member.guild.id, member.id)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _Pending(before, after, member)
+        else:
+            self.stats["collapsed"] += 1
+            pending.current = after
+            pending.member = member
+
+        self.stats["submitted"] += 1
+        self.stats["calls_requested"] += _cost(not after)
+
+        loop = asyncio.get_running_loop()
+        delay = self.window if after else self.window + self.grace
+        pending.deadline = deadline = loop.time() + delay
+        heapq.heappush(self._heap, (deadline, next(self._counter), key))
+        if deadline < self._timer_deadline:
+            self._schedule(loop, deadline)
+
+    def is_pending(self, guild_id: int, member_id: int) -> bool:
+        return (guild_id, member_id) in self._pending
+
+    def discard(self, guild_id: int, member_id: int) -> Optional[bool]:
+        """Drops a member's pending transition.
+
+        Returns whether they had the vanity before it started, or ``None``
+        if nothing was pending.
+        """
+        # the stale heap entry is skipped once it comes up
+        pending = self._pending.pop((guild_id, member_id), None)
+        if pending is None:
+            return None
+        return pending.settled
+
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._timer_deadline = float("inf")
+        self._pending.clear()
+        self._heap.clear()
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop, deadline: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_deadline = deadline
+        self._timer = loop.call_at(deadline, self._fire)
+
+    def flush(self) -> None:
+        """Settles every pending transition now instead of at its deadline."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._timer_deadline = float("inf")
+        self._settle(float("inf"))
+
+    async def join(self) -> None:
+        """Waits for the callbacks of settled transitions to finish."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _fire(self) -> None:
+        self._timer = None
+        self._timer_deadline = float("inf")
+
+        loop = asyncio.get_running_loop()
+        self._settle(loop.time())
+        if self._heap:
+            self._schedule(loop, self._heap[0][0])
+
+    def _settle(self, now: float) -> None:
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(heap)
+            pending = self._pending.get(key)
+            if pending is None or pending.deadline != deadline:
+                # superseded by a later change
+                continue
+
+            del self._pending[key]
+            if pending.current is pending.settled:
+                self.stats["cancelled"] += 1
+                continue
+
+            removed = not pending.current
+            self.stats["fired"] += 1
+            self.stats["calls_made"] += _cost(removed)
+            task = asyncio.create_task(self.callback(pending.member, removed))
+            self._tasks.add(task)
+            task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: asyncio.Task[None]) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.warning("Debounced vanity transition failed.", exc_info=task.exception())
+
+    @property
+    def calls_saved(self) -> int:
+        # only counts transitions that have been settled
+        pending = sum(_cost(not p.current) for p in self._pending.values())
+        return self.stats["calls_requested"] - self.stats["calls_made"] - pending
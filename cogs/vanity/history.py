@@ -0,0 +1,89 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any
+
+from collections import Counter
+from discord.ext import tasks
+import discord
+import asyncio
+import enum
+import logging
+
+if TYPE_CHECKING:
+    from bot import Client
+
+log = logging.getLogger(__name__)
+
+
+class EventKind(enum.IntEnum):
+    gained = 1
+    lost = 2
+    joined = 3
+    left = 4
+
+
+class EventWriter:
+    """Buffers vanity events and writes them to vanity_events with COPY.
+
+    Pushing is synchronous so the listeners never wait on the database.
+    The buffer is flushed every ``interval`` seconds or once it holds
+    ``size`` events. Flushes are serialized, so at most one pool
+    connection is in use.
+    """
+
+    columns = ("guild_id", "user_id", "kind", "status", "created_at")
+
+    def __init__(
+        self, bot: Client, *, interval: float = 5.0, size: int = 1000
+    ) -> None:
+        self.bot: Client = bot
+        self.size: int = size
+        # events that failed to write are retried up to this many
+        self.max_backlog: int = size * 50
+        self._buffer: list[tuple[Any, ...]] = []
+        self._lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._flusher = tasks.loop(seconds=interval)(self.flush)
+        self.stats: Counter[str] = Counter()
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def start(self) -> None:
+        self._flusher.start()
+
+    async def close(self) -> None:
+        self._flusher.cancel()
+        await self.flush()
+
+    def push(self, member: discord.Member, kind: EventKind, status: str) -> None:
+        created_at = discord.utils.utcnow().replace(tzinfo=None)
+        self._buffer.append((member.guild.id, member.id, kind.value, status, created_at))
+        # a backlog put back by a failed flush can already be over size,
+        # one flush at a time is enough to take it
+        if len(self._buffer) >= self.size and not self._tasks and not self._lock.locked():
+            task = asyncio.create_task(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._buffer:
+                return
+
+            records, self._buffer = self._buffer, []
+            try:
+                async with self.bot.pool.acquire(timeout=300.0) as con:
+                    await con.copy_records_to_table(
+                        "vanity_events", records=records, columns=self.columns
+                    )
+            except Exception:
+                log.warning("Failed to write %s vanity events.", len(records), exc_info=True)
+                # put them back in front of anything pushed in the meantime
+                self._buffer[:0] = records
+                overflow = len(self._buffer) - self.max_backlog
+                if overflow > 0:
+                    del self._buffer[:overflow]
+                    self.stats["dropped"] += overflow
+            else:
+                self.stats["written"] += len(records)
+                self.stats["flushes"] += 1
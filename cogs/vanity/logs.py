@@ -0,0 +1,163 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Iterator
+
+from collections import Counter
+from discord.ext import tasks
+import discord
+import asyncio
+import logging
+
+if TYPE_CHECKING:
+    from bot import Client
+
+log = logging.getLogger(__name__)
+
+# Discord's limits for a single message
+MAX_EMBEDS = 10
+MAX_DESCRIPTION = 4096
+MAX_TOTAL = 6000
+
+
+class LogDigest:
+    """Buffers vanity log entries per channel and sends them in batches.
+
+    Entries are flushed every ``interval`` seconds or once a channel has
+    ``size`` of them, whichever comes first. A flush packs the entries
+    into as few messages as Discord's embed limits allow. Entries of a
+    message that failed to send go back in the buffer for the next
+    flush, up to ``max_backlog`` per channel, unless the channel is gone
+    or we can no longer send to it.
+    """
+
+    def __init__(self, bot: Client, *, interval: float, size: int) -> None:
+        self.bot: Client = bot
+        self.size: int = size
+        self.max_backlog: int = size * 10
+        # channel_id: [(line, removed)]
+        self._buffers: dict[int, list[tuple[str, bool]]] = {}
+        self._channels: dict[int, discord.TextChannel] = {}
+        # channels with a flush in progress
+        self._flushing: set[int] = set()
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._flusher = tasks.loop(seconds=interval)(self.flush)
+        self.stats: Counter[str] = Counter()
+
+    def start(self) -> None:
+        self._flusher.start()
+
+    async def close(self) -> None:
+        self._flusher.cancel()
+        # early flushes still sending
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+    def push(
+        self, channel: discord.TextChannel, member: discord.Member, removed: bool
+    ) -> None:
+        timestamp = int(discord.utils.utcnow().timestamp())
+        line = f"<t:{timestamp}:T> {member.name} ({member.id})"
+        entries = self._buffers.setdefault(channel.id, [])
+        entries.append((line, removed))
+        self._channels[channel.id] = channel
+        self.stats["entries"] += 1
+
+        if len(entries) >= self.size and channel.id not in self._flushing:
+            self._flushing.add(channel.id)
+            task = asyncio.create_task(self.flush_channel(channel.id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def flush(self) -> None:
+        for channel_id in list(self._buffers):
+            await self.flush_channel(channel_id)
+
+    async def flush_channel(self, channel_id: int) -> None:
+        entries = self._buffers.pop(channel_id, None)
+        channel = self._channels.pop(channel_id, None)
+        if not entries or channel is None:
+            return
+
+        self._flushing.add(channel_id)
+        sent = 0
+        try:
+            for embeds, count in self._build_messages(entries):
+                try:
+                    await channel.send(embeds=embeds)
+                except (discord.NotFound, discord.Forbidden):
+                    # the channel is gone or we can't send there anymore
+                    self.stats["failed"] += 1
+                    self.stats["dropped"] += len(entries) - sent
+                    return
+                except Exception:
+                    self.stats["failed"] += 1
+                    log.debug(
+                        "Failed to send a vanity log digest to %s.", channel_id, exc_info=True
+                    )
+                    self._requeue(channel, entries[sent:])
+                    return
+                else:
+                    self.stats["messages"] += 1
+                    sent += count
+        finally:
+            self._flushing.discard(channel_id)
+
+    def _requeue(self, channel: discord.TextChannel, entries: list[tuple[str, bool]]) -> None:
+        # in front of anything pushed in the meantime
+        buffer = self._buffers.setdefault(channel.id, [])
+        buffer[:0] = entries
+        self._channels.setdefault(channel.id, channel)
+        self.stats["retried"] += len(entries)
+        overflow = len(buffer) - self.max_backlog
+        if overflow > 0:
+            del buffer[:overflow]
+            self.stats["dropped"] += overflow
+
+    def _build_embeds(
+        self, entries: list[tuple[str, bool]]
+    ) -> Iterator[tuple[discord.Embed, int]]:
+        # consecutive entries of the same kind share an embed, yielded
+        # with how many entries they hold
+        lines: list[str] = []
+        length = 0
+        kind = entries[0][1]
+        for line, removed in entries:
+            if removed is not kind or length + len(line) + 1 > MAX_DESCRIPTION:
+                yield self._make_embed(lines, kind), len(lines)
+                lines = []
+                length = 0
+                kind = removed
+
+            lines.append(line)
+            length += len(line) + 1
+
+        if lines:
+            yield self._make_embed(lines, kind), len(lines)
+
+    def _make_embed(self, lines: list[str], removed: bool) -> discord.Embed:
+        return discord.Embed(
+            title="No longer has vanity" if removed else "Has vanity",
+            color=self.bot.colors.deny if removed else self.bot.colors.approve,
+            description="\n".join(lines),
+        )
+
+    def _build_messages(
+        self, entries: list[tuple[str, bool]]
+    ) -> Iterator[tuple[list[discord.Embed], int]]:
+        embeds: list[discord.Embed] = []
+        total = 0
+        count = 0
+        for embed, lines in self._build_embeds(entries):
+            size = len(embed)
+            if embeds and (len(embeds) == MAX_EMBEDS or total + size > MAX_TOTAL):
+                yield embeds, count
+                embeds = []
+                total = 0
+                count = 0
+
+            embeds.append(embed)
+            total += size
+            count += lines
+
+        if embeds:
+            yield embeds, count
@@ -0,0 +1,76 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Callable, Optional
+
+import discord
+import enum
+import unicodedata
+
+if TYPE_CHECKING:
+    from typing_extensions import TypeAlias
+
+    Matcher: TypeAlias = Callable[[str], bool]
+
+
+class MatchMode(enum.Enum):
+    exact = "exact"
+    substring = "substring"
+    insensitive = "insensitive"
+    normalized = "normalized"
+
+    @classmethod
+    def from_config(cls, config) -> MatchMode:
+        mode = getattr(config, "vanity_match_mode", None)
+        if mode is not None:
+            return cls(mode)
+        return cls.exact if config.strict_vanity else cls.substring
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def _never(text: str) -> bool:
+    return False
+
+
+def compile_matcher(status: Optional[str], mode: MatchMode) -> Matcher:
+    """Compiles a custom status into a single callable.
+
+    The returned function takes the text of a member's custom status
+    (an empty string if they have none) and returns whether it
+    represents the vanity.
+    All of the per mode work that does not depend on the member is
+    done here once rather than on every event.
+    """
+
+    if not status:
+        return _never
+
+    if mode is MatchMode.exact:
+        return status.__eq__
+
+    if mode is MatchMode.substring:
+
+        def match(text: str) -> bool:
+            return status in text
+
+    elif mode is MatchMode.insensitive:
+        folded = status.casefold()
+
+        def match(text: str) -> bool:
+            return folded in text.casefold()
+
+    else:
+        normalized = _normalize(status)
+
+        def match(text: str) -> bool:
+            return normalized in _normalize(text)
+
+    return match
+
+
+def get_custom_status(member: discord.Member) -> str:
+    for activity in member.activities:
+        if isinstance(activity, discord.CustomActivity):
+            return activity.name or ""
+    return ""
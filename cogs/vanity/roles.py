@@ -0,0 +1,198 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Deque, Optional, Tuple
+
+from cogs.utils.cache import ExpiringCache
+from collections import Counter, deque
+from discord.ext import commands
+import discord
+import asyncio
+import logging
+
+if TYPE_CHECKING:
+    from bot import Client
+
+log = logging.getLogger(__name__)
+
+# (guild_id, member_id, role_id)
+Key = Tuple[int, int, int]
+
+
+class RoleQueue:
+    """Sends role mutations in the background.
+
+    At most one mutation per (guild, member, role) is pending at a time,
+    queueing the opposite of a pending mutation cancels both out.
+    The role endpoints share a per guild rate limit bucket, so mutations
+    wait in a queue per guild and the workers take turns between the
+    guilds. A guild that is out of requests is set aside until its bucket
+    refills instead of holding up a worker another guild could use.
+    """
+
+    def __init__(
+        self, bot: Client, *, concurrency: int = 4, rate: int = 10, per: float = 10.0
+    ) -> None:
+        self.bot: Client = bot
+        self.concurrency: int = concurrency
+        self.rate: int = rate
+        self.per: float = per
+        # key: whether to add (True) or remove (False) the role
+        self._pending: dict[Key, bool] = {}
+        self._in_flight: set[Key] = set()
+        # guild_id: its keys in the order they were queued, keys that were
+        # cancelled out since are skipped
+        self._guilds: dict[int, Deque[Key]] = {}
+        # guild_id: how many of _pending are for it
+        self._guild_pending: Counter[int] = Counter()
+        # guilds with keys queued, either waiting in _ready or on their bucket
+        self._scheduled: set[int] = set()
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        # guild_id: the timer putting it back in _ready
+        self._delayed: dict[int, asyncio.TimerHandle] = {}
+        # guild_id: Cooldown, dropped once a guild's window has passed
+        self._buckets: ExpiringCache = ExpiringCache(per)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers: list[asyncio.Task[None]] = []
+        self.stats: Counter[str] = Counter()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def pending(self, guild_id: int) -> int:
+        return self._guild_pending[guild_id]
+
+    def start(self) -> None:
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.concurrency)
+        ]
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        for timer in self._delayed.values():
+            timer.cancel()
+        self._delayed.clear()
+        if self._pending:
+            log.info("Dropping %s pending role mutations.", len(self._pending))
+            self._pending.clear()
+        self._guilds.clear()
+        self._guild_pending.clear()
+        self._scheduled.clear()
+        self._idle.set()
+
+    def push(self, member: discord.Member, role: discord.Role, *, add: bool) -> None:
+        key = (member.guild.id, member.id, role.id)
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = add
+            self._guild_pending[key[0]] += 1
+            self._idle.clear()
+            self.stats["queued"] += 1
+            if key not in self._in_flight:
+                self._enqueue(key)
+        elif pending is not add:
+            # never sent, the two cancel out
+            del self._pending[key]
+            self._uncount(key)
+            self.stats["coalesced"] += 2
+        else:
+            self.stats["duplicate"] += 1
+
+    async def join(self) -> None:
+        """Waits until every queued mutation has been sent or dropped."""
+        await self._idle.wait()
+
+    def _uncount(self, key: Key) -> None:
+        guild_id = key[0]
+        self._guild_pending[guild_id] -= 1
+        if self._guild_pending[guild_id] <= 0:
+            del self._guild_pending[guild_id]
+        if not self._pending and not self._in_flight:
+            self._idle.set()
+
+    def _enqueue(self, key: Key) -> None:
+        guild_id = key[0]
+        self._guilds.setdefault(guild_id, deque()).append(key)
+        if guild_id not in self._scheduled:
+            self._scheduled.add(guild_id)
+            self._ready.put_nowait(guild_id)
+
+    def _get_bucket(self, guild_id: int) -> commands.Cooldown:
+        bucket = self._buckets.get(guild_id)
+        if bucket is None:
+            bucket = commands.Cooldown(self.rate, self.per)
+        # the window can't have passed until ``per`` after its last use
+        self._buckets[guild_id] = bucket
+        return bucket
+
+    def _undelay(self, guild_id: int) -> None:
+        del self._delayed[guild_id]
+        self._ready.put_nowait(guild_id)
+
+    def _next(self, guild_id: int) -> Optional[Key]:
+        keys = self._guilds.get(guild_id)
+        # skip keys that were cancelled out, or are in flight and get
+        # queued again once that finishes
+        while keys and (keys[0] not in self._pending or keys[0] in self._in_flight):
+            keys.popleft()
+
+        if not keys:
+            self._guilds.pop(guild_id, None)
+            self._scheduled.discard(guild_id)
+            return None
+
+        retry_after = self._get_bucket(guild_id).update_rate_limit()
+        if retry_after is not None:
+            self.stats["paced"] += 1
+            loop = asyncio.get_running_loop()
+            self._delayed[guild_id] = loop.call_later(retry_after, self._undelay, guild_id)
+            return None
+
+        key = keys.popleft()
+        if keys:
+            # to the back of the line, other guilds get their turn first
+            self._ready.put_nowait(guild_id)
+        else:
+            del self._guilds[guild_id]
+            self._scheduled.discard(guild_id)
+        return key
+
+    async def _worker(self) -> None:
+        while True:
+            guild_id = await self._ready.get()
+            key = self._next(guild_id)
+            if key is not None:
+                await self._process(key)
+
+    async def _process(self, key: Key) -> None:
+        add = self._pending.pop(key)
+        self._in_flight.add(key)
+        try:
+            await self._send(key, add)
+        finally:
+            self._in_flight.discard(key)
+            if key in self._pending:
+                # changed again while it was in flight
+                self._enqueue(key)
+            self._uncount(key)
+
+    async def _send(self, key: Key, add: bool) -> None:
+        guild_id, member_id, role_id = key
+        try:
+            if add:
+                await self.bot.http.add_role(
+                    guild_id, member_id, role_id, reason="Vanity role"
+                )
+            else:
+                await self.bot.http.remove_role(
+                    guild_id, member_id, role_id, reason="Vanity role"
+                )
+        except (discord.NotFound, discord.Forbidden):
+            # the member left, the role was deleted or we lost permissions
+            self.stats["failed"] += 1
+        except Exception:
+            self.stats["failed"] += 1
+            log.warning("Failed to update the vanity role in %s.", guild_id, exc_info=True)
+        else:
+            self.stats["added" if add else "removed"] += 1
@@ -0,0 +1,145 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Iterable, Optional
+
+from collections import Counter
+from cogs.utils import metrics
+import json
+import time
+import uuid
+
+if TYPE_CHECKING:
+    from redis.typing import EncodableT, FieldT
+    import redis.asyncio as redis
+
+# the vanity_config columns, in table order
+COLUMNS = (
+    "guild_id",
+    "custom_status",
+    "award_role_id",
+    "thank_you_message",
+    "thank_you_channel_id",
+    "log_channel_id",
+)
+
+
+class ConfigStore:
+    """Shares vanity_config rows between processes in a Redis hash.
+
+    Sits between the in-process caches and PostgreSQL: every field of
+    the ``vanity:config`` hash is a guild ID holding its row as JSON.
+    Only rows that exist are stored, a missing field means ask
+    PostgreSQL. Full copies of the table are built under a temporary key
+    and renamed over the hash with the ``complete`` field set, after
+    which processes can load every row with a single HGETALL. The marker
+    lives in the same hash so an evicted hash can't leave it behind.
+
+    Read-through fills only add missing fields, refreshes after a change
+    overwrite them and store deleted rows as ``null``. A fill that read
+    PostgreSQL before the change can't replace what the refresh wrote.
+    """
+
+    key = "vanity:config"
+    complete_field = "complete"
+    # the value of a deleted row
+    deleted = "null"
+
+    def __init__(self, redis: redis.Redis, *, batch_size: int = 1000) -> None:
+        self.redis: redis.Redis = redis
+        self.batch_size: int = batch_size
+        self.stats: Counter[str] = Counter()
+
+    @staticmethod
+    def dump(record: Any) -> str:
+        return json.dumps([record[column] for column in COLUMNS])
+
+    @staticmethod
+    def load(raw: bytes | str) -> dict[str, Any]:
+        return dict(zip(COLUMNS, json.loads(raw)))
+
+    async def get(self, guild_id: int) -> tuple[bool, Optional[dict[str, Any]]]:
+        """Whether the row is stored, and the row if the guild has one."""
+
+        started = time.perf_counter()
+        raw = await self.redis.hget(self.key, str(guild_id))
+        metrics.redis_latency.observe(time.perf_counter() - started, "hget")
+        if raw is None:
+            self.stats["misses"] += 1
+            return False, None
+
+        self.stats["hits"] += 1
+        if raw in (self.deleted, self.deleted.encode()):
+            return True, None
+        return True, self.load(raw)
+
+    async def set(self, record: Any, *, overwrite: bool = False) -> None:
+        """Stores a row, keeping the stored one unless ``overwrite`` is set."""
+
+        field, value = str(record["guild_id"]), self.dump(record)
+        started = time.perf_counter()
+        if overwrite:
+            await self.redis.hset(self.key, field, value)
+            metrics.redis_latency.observe(time.perf_counter() - started, "hset")
+        else:
+            await self.redis.hsetnx(self.key, field, value)
+            metrics.redis_latency.observe(time.perf_counter() - started, "hsetnx")
+        self.stats["writes"] += 1
+
+    async def delete(self, guild_id: int) -> None:
+        """Marks the row as deleted, until the next full copy drops it."""
+
+        started = time.perf_counter()
+        await self.redis.hset(self.key, str(guild_id), self.deleted)
+        metrics.redis_latency.observe(time.perf_counter() - started, "hset")
+        self.stats["deletes"] += 1
+
+    async def clear(self) -> None:
+        await self.redis.delete(self.key)
+
+    def copy_key(self) -> str:
+        return f"{self.key}:copy:{uuid.uuid4().hex}"
+
+    async def set_many(self, key: str, records: Iterable[Any]) -> None:
+        mapping: dict[FieldT, EncodableT] = {
+            str(record["guild_id"]): self.dump(record) for record in records
+        }
+        if not mapping:
+            return
+
+        started = time.perf_counter()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping=mapping)
+            # abandoned copies clean themselves up
+            pipe.expire(key, 3600)
+            await pipe.execute()
+        metrics.redis_latency.observe(time.perf_counter() - started, "hset")
+        self.stats["writes"] += len(mapping)
+
+    async def finish_copy(self, key: str) -> None:
+        """Replaces the hash with a finished copy of the table."""
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, self.complete_field, "1")
+            pipe.persist(key)
+            pipe.rename(key, self.key)
+            await pipe.execute()
+        self.stats["copies"] += 1
+
+    async def load_all(self) -> Optional[list[dict[str, Any]]]:
+        """Every stored row, or None if the table was never copied in completely."""
+
+        started = time.perf_counter()
+        stored: dict[bytes | str, bytes | str] = await self.redis.hgetall(self.key)
+        metrics.redis_latency.observe(time.perf_counter() - started, "hgetall")
+        complete = self.complete_field.encode()
+        if complete not in stored and self.complete_field not in stored:
+            self.stats["incomplete_loads"] += 1
+            return None
+
+        self.stats["bulk_loads"] += 1
+        skipped = (complete, self.complete_field)
+        deleted = (self.deleted, self.deleted.encode())
+        return [
+            self.load(raw)
+            for field, raw in stored.items()
+            if field not in skipped and raw not in deleted
+        ]
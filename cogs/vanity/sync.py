@@ -0,0 +1,168 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Optional
+
+from collections import Counter
+from .matcher import get_custom_status
+import discord
+import asyncio
+import logging
+import time
+
+if TYPE_CHECKING:
+    from .vanity import Vanity
+
+log = logging.getLogger(__name__)
+
+
+class SyncJob:
+    """The progress of reconciling one guild's award roles."""
+
+    def __init__(self, guild: discord.Guild) -> None:
+        self.guild_id: int = guild.id
+        # a snapshot, members joining later are handled by the listeners
+        self.members: list[discord.Member] = list(guild.members)
+        self.position: int = 0
+        self.added: int = 0
+        self.removed: int = 0
+        # whether the walk raised, it's done but didn't get through
+        self.failed: bool = False
+        self.started_at: float = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task[None]] = None
+        self._done = asyncio.Event()
+
+    @property
+    def total(self) -> int:
+        return len(self.members)
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished_at or time.monotonic()
+        return end - self.started_at
+
+    async def wait(self) -> None:
+        await self._done.wait()
+
+
+class Reconciler:
+    """Brings award roles in line with members' current custom statuses.
+
+    Members are walked in chunks that yield to the event loop and are
+    paced to ``rate`` members per second. Role updates go through the
+    cog's role queue and the walk pauses while the guild has more than
+    ``max_pending`` updates waiting there, so live updates in the guild
+    don't queue up behind the whole sweep. Members whose transition the
+    debouncer is still holding are left to it. A cancelled job keeps its
+    position and picks up from there when started again.
+    """
+
+    def __init__(
+        self,
+        cog: Vanity,
+        *,
+        chunk_size: int = 500,
+        rate: float = 5000.0,
+        max_pending: int = 20,
+    ) -> None:
+        self.cog: Vanity = cog
+        self.chunk_size: int = chunk_size
+        self.rate: float = rate
+        self.max_pending: int = max_pending
+        # guild_id: SyncJob
+        self.jobs: dict[int, SyncJob] = {}
+        # background sweeps go one guild at a time
+        self._sweep_lock = asyncio.Semaphore(1)
+        self.stats: Counter[str] = Counter()
+
+    def get_job(self, guild_id: int) -> Optional[SyncJob]:
+        return self.jobs.get(guild_id)
+
+    def start(self, guild: discord.Guild, *, background: bool = False) -> SyncJob:
+        job = self.jobs.get(guild.id)
+        if job is None or job.done:
+            job = self.jobs[guild.id] = SyncJob(guild)
+        if not job.running:
+            job.task = asyncio.create_task(self._run(job, background=background))
+        return job
+
+    def close(self) -> None:
+        for job in self.jobs.values():
+            if job.task is not None:
+                job.task.cancel()
+
+    async def _run(self, job: SyncJob, *, background: bool) -> None:
+        try:
+            if background:
+                async with self._sweep_lock:
+                    await self._walk(job)
+            else:
+                await self._walk(job)
+        except Exception:
+            log.exception("Failed to sync vanity roles in %s.", job.guild_id)
+            job.failed = True
+            job.finished_at = time.monotonic()
+            job._done.set()
+
+    async def _walk(self, job: SyncJob) -> None:
+        config = await self.cog.get_config(job.guild_id)
+        if config is None or not config.is_enabled or config.award_role is None:
+            job.finished_at = time.monotonic()
+            job._done.set()
+            return
+
+        role = config.award_role
+        queue = self.cog.role_queue
+        debouncer = self.cog.debouncer
+        members = job.members
+        per_chunk = self.chunk_size / self.rate
+        while job.position < len(members):
+            started = time.perf_counter()
+            end = min(job.position + self.chunk_size, len(members))
+            for position in range(job.position, end):
+                member = members[position]
+                job.position = position + 1
+                self.stats["members_checked"] += 1
+                if member.bot:
+                    continue
+                if debouncer is not None and debouncer.is_pending(job.guild_id, member.id):
+                    # it settles the member's role itself
+                    self.stats["members_debounced"] += 1
+                    continue
+
+                has_vanity = config.matches(get_custom_status(member))
+                has_role = member.get_role(role.id) is not None
+                if has_vanity and not has_role:
+                    queue.push(member, role, add=True)
+                    job.added += 1
+                elif not has_vanity and has_role:
+                    queue.push(member, role, add=False)
+                    job.removed += 1
+                else:
+                    continue
+
+                # let the guild's role updates catch up before piling more on
+                while queue.pending(job.guild_id) >= self.max_pending:
+                    self.stats["waits"] += 1
+                    await asyncio.sleep(1.0)
+
+            await asyncio.sleep(max(per_chunk - (time.perf_counter() - started), 0))
+
+        job.finished_at = time.monotonic()
+        job._done.set()
+        self.stats["jobs_finished"] += 1
+        log.info(
+            "Synced vanity roles in %s: %s added, %s removed (%s members in %.1fs).",
+            job.guild_id,
+            job.added,
+            job.removed,
+            job.total,
+            job.elapsed,
+        )
@@ -1,35 +1,493 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING, Optional
 
+from collections import Counter
 from .config import VanityConfig
-from cogs.utils import cache
+from .debounce import PresenceDebouncer
+from .roles import RoleQueue
+from .logs import LogDigest
+from .sync import Reconciler
+from .history import EventKind, EventWriter
+from .store import COLUMNS, ConfigStore
+from .matcher import get_custom_status
+from cogs.utils import cache, metrics
+from cogs.utils.parsers import Parser, install_parser, uninstall_parser
 from discord.ext import commands
 from discord import app_commands
 import discord
+import asyncio
+import asyncpg
+import logging
+import time
 
 if TYPE_CHECKING:
     from bot import Client
     from cogs.utils.context import GuildContext
+    from typing import Any, AsyncIterator, Iterator
 
+log = logging.getLogger(__name__)
 
 class Vanity(commands.Cog):
     def __init__(self, bot: Client):
         self.bot = bot
+        # guild IDs that have a custom status set, this lets the presence
+        # listener reject events without touching the config cache at all
+        self.enabled_guild_ids: set[int] = set()
+        # guild_id: VanityConfig
+        # only set when the table is preloaded, it is then authoritative
+        # and get_guild_config is no longer consulted by the listeners
+        self.configs: Optional[dict[int, VanityConfig]] = None
+        self.configs_ready = asyncio.Event()
+        # guild_id: VanityConfig, rows refreshed while a preload is streaming
+        self._refreshed: Optional[dict[int, Optional[VanityConfig]]] = None
+        self._refresh_tasks: set[asyncio.Task[Optional[VanityConfig]]] = set()
+        self._listener_task: Optional[asyncio.Task[None]] = None
+        self._preload_task: Optional[asyncio.Task[None]] = None
+        self._presence_filter: Optional[Parser] = None
+        self.stats: Counter[str] = Counter()
+
+        # (guild_id, member_id) of recent thank yous, saves the Redis round trip
+        # for repeats inside the cooldown
+        self.thank_you_cooldown: int = getattr(
+            bot.config, "vanity_thank_you_cooldown", 30
+        )
+        self._recent_thank_yous = cache.ExpiringCache(
+            seconds=self.thank_you_cooldown, maxsize=10_000
+        )
+
+        rate, per = getattr(bot.config, "vanity_role_rate", (10, 10.0))
+        self.role_queue = RoleQueue(
+            bot,
+            concurrency=getattr(bot.config, "vanity_role_concurrency", 4),
+            rate=rate,
+            per=per,
+        )
+
+        self.reconciler = Reconciler(
+            self, rate=getattr(bot.config, "vanity_sync_rate", 5000.0)
+        )
+        self._swept_at_startup: bool = False
+        self._chunk_semaphore = asyncio.Semaphore(
+            getattr(bot.config, "chunk_concurrency", 2)
+        )
+        self._chunk_tasks: set[asyncio.Task[None]] = set()
+
+        # shares config rows between processes, see ConfigStore
+        self.config_store: Optional[ConfigStore] = None
+        if getattr(bot.config, "vanity_config_redis", False):
+            self.config_store = ConfigStore(bot.redis)
+
+        self.history: Optional[EventWriter] = None
+        if getattr(bot.config, "vanity_event_history", False):
+            self.history = EventWriter(bot)
+
+        interval = getattr(bot.config, "vanity_log_digest_interval", 0.0)
+        self.log_digest: Optional[LogDigest] = None
+        if interval:
+            self.log_digest = LogDigest(
+                bot,
+                interval=interval,
+                size=getattr(bot.config, "vanity_log_digest_size", 100),
+            )
+
+        window = getattr(bot.config, "vanity_debounce_window", 0.0)
+        grace = getattr(bot.config, "vanity_removal_grace", 0.0)
+        self.debouncer: Optional[PresenceDebouncer] = None
+        if window or grace:
+            self.debouncer = PresenceDebouncer(
+                self.apply_debounced_transition, window=window, grace=grace
+            )
+
+    async def cog_load(self) -> None:
+        metrics.registry.register(self.collect_metrics)
+        self.install_presence_filter()
+        self.role_queue.start()
+        if self.log_digest is not None:
+            self.log_digest.start()
+        if self.history is not None:
+            self.history.start()
+        if getattr(self.bot.config, "vanity_config_notify", True):
+            self._listener_task = asyncio.create_task(self.listen_for_changes())
+
+        if getattr(self.bot.config, "vanity_preload", False):
+            # lookups stay lazy until the preloaded configs are swapped in
+            self._preload_task = asyncio.create_task(self.preload_configs())
+            return
+
+        await self.load_enabled_guild_ids()
+        self.configs_ready.set()
+
+    async def cog_unload(self) -> None:
+        metrics.registry.unregister(self.collect_metrics)
+        self.uninstall_presence_filter()
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+        self.reconciler.close()
+        self.role_queue.close()
+        if self.log_digest is not None:
+            await self.log_digest.close()
+        if self.history is not None:
+            await self.history.close()
+        if self.debouncer is not None:
+            self.debouncer.close()
+        if self._preload_task is not None:
+            self._preload_task.cancel()
+
+    def collect_metrics(self) -> Iterator[metrics.Sample]:
+        yield from metrics.counter_samples(
+            "vanity_events_total", "Vanity events by outcome.", self.stats, label="event"
+        )
+        components = {
+            "role_queue": self.role_queue,
+            "debouncer": self.debouncer,
+            "log_digest": self.log_digest,
+            "history": self.history,
+            "reconciler": self.reconciler,
+            "config_store": self.config_store,
+        }
+        for name, component in components.items():
+            if component is not None:
+                yield from metrics.counter_samples(
+                    "vanity_component_events_total",
+                    "Events of the Vanity cog's background components.",
+                    component.stats,
+                    label="event",
+                    component=name,
+                )
+
+        yield metrics.Sample(
+            "vanity_enabled_guilds",
+            "gauge",
+            "Guilds with a custom status set.",
+            {},
+            len(self.enabled_guild_ids),
+        )
+        yield metrics.Sample(
+            "vanity_role_queue_pending",
+            "gauge",
+            "Role updates waiting to be sent.",
+            {},
+            len(self.role_queue),
+        )
+        if self.debouncer is not None:
+            yield metrics.Sample(
+                "vanity_debouncer_calls_saved",
+                "gauge",
+                "Role updates the debouncer avoided by settling flapping statuses.",
+                {},
+                self.debouncer.calls_saved,
+            )
+
+    def install_presence_filter(self) -> None:
+        # The debug socket events can only observe payloads, so this wraps
+        # the PRESENCE_UPDATE parser the gateway hands payloads to instead.
+        # Payloads we drop here never get a Member looked up, copied and
+        # dispatched, which is most of the cost of a presence update.
+        get_guild = self.bot._connection._get_guild
+        stats = self.stats
+        ready = self.configs_ready
+
+        def parse_presence_update(data: dict[str, Any]) -> None:
+            if ready.is_set():
+                guild_id = int(data["guild_id"])
+                if guild_id not in self.enabled_guild_ids:
+                    stats["raw_presence_unconfigured"] += 1
+                    return
+
+                guild = get_guild(guild_id)
+                member = guild and guild.get_member(int(data["user"]["id"]))
+                if member is not None:
+                    status = ""
+                    for activity in data.get("activities") or ():
+                        if activity.get("type") == 4:
+                            status = activity.get("state") or ""
+                            break
+
+                    if member.bot or status == get_custom_status(member):
+                        stats["raw_presence_unchanged"] += 1
+                        return
+
+            parse_presence_update.original(data)
+
+        self._presence_filter = parse_presence_update
+        install_parser(
+            self.bot._connection.parsers, "PRESENCE_UPDATE", parse_presence_update
+        )
+
+    def uninstall_presence_filter(self) -> None:
+        if self._presence_filter is not None:
+            uninstall_parser(
+                self.bot._connection.parsers, "PRESENCE_UPDATE", self._presence_filter
+            )
+            self._presence_filter = None
+
+    async def load_enabled_guild_ids(self) -> None:
+        query = """SELECT guild_id FROM vanity_config WHERE custom_status IS NOT NULL"""
+        records = await self.bot.pool.fetch(query)
+        self.enabled_guild_ids = {record["guild_id"] for record in records}
+
+    def on_our_shards(self, guild_id: int) -> bool:
+        if self.bot.shard_ids is None or self.bot.shard_count is None:
+            return True
+        return (guild_id >> 22) % self.bot.shard_count in self.bot.shard_ids
+
+    async def iter_config_records(self, *, fresh: bool = False) -> AsyncIterator[Any]:
+        # Rows come from Redis if it holds a complete copy, otherwise they
+        # are streamed from PostgreSQL and copied into Redis on the way.
+        store = self.config_store
+        if store is not None and not fresh:
+            try:
+                stored = await store.load_all()
+            except Exception:
+                log.warning("Failed to load vanity configs from Redis.", exc_info=True)
+                stored = None
+
+            if stored is not None:
+                for record in stored:
+                    yield record
+                return
+
+        query = """SELECT * FROM vanity_config"""
+        args = ()
+        shard_ids, shard_count = self.bot.shard_ids, self.bot.shard_count
+        if store is None and shard_ids is not None and shard_count is not None:
+            # only the rows for guilds that are on our shards, unless we are
+            # copying the whole table into Redis
+            query += """ WHERE ((guild_id >> 22) % $1) = ANY($2::int[])"""
+            args = (shard_count, list(shard_ids))
+
+        copy: Optional[tuple[ConfigStore, str]] = None
+        if store is not None:
+            copy = (store, store.copy_key())
+
+        batch: list[Any] = []
+        async with self.bot.pool.acquire(timeout=300.0) as con:
+            async with con.transaction():
+                async for record in con.cursor(query, *args, prefetch=1000):
+                    yield record
+                    if copy is not None:
+                        batch.append(record)
+                        if len(batch) == copy[0].batch_size:
+                            copy = await self._copy_configs(copy, batch)
+                            batch = []
+
+        if copy is not None:
+            await self._copy_configs(copy, batch, finish=True)
+
+    async def _copy_configs(
+        self, copy: tuple[ConfigStore, str], records: list[Any], *, finish: bool = False
+    ) -> Optional[tuple[ConfigStore, str]]:
+        store, key = copy
+        try:
+            await store.set_many(key, records)
+            if finish:
+                await store.finish_copy(key)
+        except Exception:
+            log.warning("Failed to copy vanity configs to Redis.", exc_info=True)
+            # give up on this copy, it expires by itself
+            return None
+        return copy
+
+    async def preload_configs(self, *, fresh: bool = False) -> None:
+        initial = not self.configs_ready.is_set()
+        configs: dict[int, VanityConfig] = {}
+        self._refreshed = {}
+        try:
+            async for record in self.iter_config_records(fresh=fresh):
+                if self.on_our_shards(record["guild_id"]):
+                    config = VanityConfig.from_record(record, self.bot)
+                    configs[config.guild_id] = config
+        except Exception:
+            if not initial:
+                log.exception("Failed to reload vanity configs, keeping the old ones.")
+                return
+
+            log.exception("Failed to preload vanity configs, falling back to lazy lookups.")
+            self.configs = None
+            await self.load_enabled_guild_ids()
+        else:
+            # rows refreshed by a /vanity command while streaming win, the
+            # copy in Redis may have replaced them there too
+            for guild_id, refreshed in self._refreshed.items():
+                if refreshed is None:
+                    configs.pop(guild_id, None)
+                else:
+                    configs[guild_id] = refreshed
+                await self.store_config(guild_id, refreshed, overwrite=True)
+
+            self.configs = configs
+            self.enabled_guild_ids = {
+                guild_id for guild_id, config in configs.items() if config.is_enabled
+            }
+            log.info("Preloaded %s vanity configs.", len(configs))
+        finally:
+            self._refreshed = None
+            # release any events that were held while loading
+            self.configs_ready.set()
+
+    async def reload_configs(self) -> None:
+        # Redis might have missed the same changes, so it gets rebuilt too
+        if not self.configs_ready.is_set():
+            # configs is None until the first preload is done
+            await self.configs_ready.wait()
+
+        self.get_guild_config.cache.clear()
+        if self.configs is not None:
+            await self.preload_configs(fresh=True)
+            return
+
+        if self.config_store is not None:
+            try:
+                await self.config_store.clear()
+            except Exception:
+                log.warning("Failed to clear the vanity configs in Redis.", exc_info=True)
+        await self.load_enabled_guild_ids()
+
+    async def listen_for_changes(self) -> None:
+        # Other processes (or someone editing the table by hand) change rows
+        # under us, the trigger added in V2 tells us which guild to refresh.
+        # Pooled connections lose their listeners on release so this holds
+        # a dedicated one.
+        reconnecting = False
+        backoff = 1.0
+        while True:
+            try:
+                con: asyncpg.Connection = await asyncpg.connect(
+                    self.bot.config.postgresql
+                )
+            except Exception:
+                log.warning(
+                    "Could not connect the vanity_config listener, retrying in %.0fs.",
+                    backoff,
+                    exc_info=True,
+                )
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
+                continue
+
+            backoff = 1.0
+            closed = asyncio.Event()
+            con.add_termination_listener(lambda _: closed.set())
+            try:
+                await con.add_listener("vanity_config", self._on_config_notify)
+                if reconnecting:
+                    # we might have missed notifications while disconnected
+                    await self.reload_configs()
+
+                while not closed.is_set():
+                    try:
+                        await asyncio.wait_for(closed.wait(), timeout=60.0)
+                    except asyncio.TimeoutError:
+                        # idle connections don't notice a dead socket
+                        await con.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.warning("The vanity_config listener connection failed.", exc_info=True)
+            finally:
+                if not con.is_closed():
+                    await con.close()
+
+            log.info("Reconnecting the vanity_config listener.")
+            reconnecting = True
+
+    def _on_config_notify(
+        self, connection: asyncpg.Connection, pid: int, channel: str, payload: str
+    ) -> None:
+        try:
+            guild_id = int(payload)
+        except ValueError:
+            return
+
+        self.stats["config_notifications"] += 1
+        task = asyncio.create_task(self.refresh_guild_config(guild_id))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._on_refresh_done)
+
+    def _on_refresh_done(self, task: asyncio.Task[Optional[VanityConfig]]) -> None:
+        self._refresh_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.warning("Failed to refresh a vanity config.", exc_info=task.exception())
 
     @cache.cache(maxsize=1024, strategy=cache.Strategy.lru)
     async def get_guild_config(self, guild_id: int) -> Optional[VanityConfig]:
+        if self.config_store is not None:
+            try:
+                found, stored = await self.config_store.get(guild_id)
+            except Exception:
+                self.stats["config_store_failed"] += 1
+            else:
+                if found:
+                    if stored is None:
+                        return None
+                    return VanityConfig.from_record(stored, self.bot)
+
+        config = await self.fetch_guild_config(guild_id)
+        if config is not None:
+            # doesn't replace a row a refresh stored in the meantime
+            await self.store_config(guild_id, config)
+        return config
+
+    async def fetch_guild_config(self, guild_id: int) -> Optional[VanityConfig]:
         query = """SELECT * FROM vanity_config WHERE guild_id = $1"""
         async with self.bot.pool.acquire(timeout=300.0) as con:
             record = await con.fetchrow(query, guild_id)
-            if record is not None:
-                return VanityConfig.from_record(record, self.bot)
+
+        if record is None:
             return None
+        return VanityConfig.from_record(record, self.bot)
+
+    async def store_config(
+        self, guild_id: int, config: Optional[VanityConfig], *, overwrite: bool = False
+    ) -> None:
+        # Only the refreshes that follow a change overwrite what Redis has,
+        # read-through fills could be holding a row from before the change.
+        if self.config_store is None:
+            return
+
+        try:
+            if config is None:
+                await self.config_store.delete(guild_id)
+            else:
+                await self.config_store.set(
+                    {column: getattr(config, column) for column in COLUMNS},
+                    overwrite=overwrite,
+                )
+        except Exception:
+            self.stats["config_store_failed"] += 1
+
+    async def get_config(self, guild_id: int) -> Optional[VanityConfig]:
+        if self.configs is not None:
+            return self.configs.get(guild_id)
+        return await self.get_guild_config(guild_id)
+
+    async def refresh_guild_config(self, guild_id: int) -> Optional[VanityConfig]:
+        # reloads the row from PostgreSQL and replaces it in every cache
+        config = await self.fetch_guild_config(guild_id)
+        await self.store_config(guild_id, config, overwrite=True)
+        self.get_guild_config.invalidate(self, guild_id)
+        if self.configs is not None:
+            if config is None:
+                self.configs.pop(guild_id, None)
+            else:
+                self.configs[guild_id] = config
+        if self._refreshed is not None:
+            # the preload in progress may have streamed the old row
+            self._refreshed[guild_id] = config
+
+        if config is not None and config.is_enabled:
+            self.enabled_guild_ids.add(guild_id)
+        else:
+            self.enabled_guild_ids.discard(guild_id)
+        return config
 
     async def send_log(
         self, config: VanityConfig, member: discord.Member, removed: bool
     ) -> None:
         channel = config.log_channel
-        if channel is not None:
+        if channel is not None and self.log_digest is not None:
+            self.log_digest.push(channel, member, removed)
+        elif channel is not None:
             embed = discord.Embed(
                 color=self.bot.colors.deny if removed else self.bot.colors.approve,
                 description=f"{member.name} {'no longer has' if removed else 'has'} vanity in the custom status ({member.id})",
@@ -37,7 +495,7 @@ class Vanity(commands.Cog):
             try:
                 await channel.send(embed=embed)
             except Exception:
-                pass
+                self.stats["log_failed"] += 1
 
     async def send_thank_you(
         self, config: VanityConfig, member: discord.Member
@@ -45,10 +503,21 @@ class Vanity(commands.Cog):
         if config.thank_you_channel is None or config.thank_you_message is None:
             return
 
+        local_key = (member.guild.id, member.id)
+        if local_key in self._recent_thank_yous:
+            self.stats["thank_you_local_hits"] += 1
+            return
+        self._recent_thank_yous[local_key] = True
+
+        # SET NX is atomic, so only one process gets to send it
         key = f"vanity:thankyou:{member.guild.id}:{member.id}"
-        if await self.bot.redis.get(key):
+        self.stats["thank_you_redis_calls"] += 1
+        started = time.perf_counter()
+        created = await self.bot.redis.set(key, 1, ex=self.thank_you_cooldown, nx=True)
+        metrics.redis_latency.observe(time.perf_counter() - started, "set")
+        if not created:
+            self.stats["thank_you_redis_hits"] += 1
             return
-        await self.bot.redis.set(key, 1, ex=30)
 
         channel = config.thank_you_channel
         text = config.thank_you_message.format(user=member, guild=member.guild)
@@ -56,115 +525,192 @@ class Vanity(commands.Cog):
             try:
                 await channel.send(text)
             except Exception:
-                pass
+                self.stats["thank_you_failed"] += 1
 
-    async def award_role(
+    def award_role(
         self, config: VanityConfig, member: discord.Member, removed: bool
     ) -> None:
-        if config.award_role is None:
+        role = config.award_role
+        if role is None:
             return
 
-        role = config.award_role
-        if role is not None:
-            if removed:
-                try:
-                    await member.remove_roles(role, reason="Vanity role")
-                except Exception:
-                    pass
+        if removed:
+            self.role_queue.push(member, role, add=False)
+        elif role not in member.roles:
+            self.role_queue.push(member, role, add=True)
+
+    async def apply_transition(
+        self, config: VanityConfig, member: discord.Member, removed: bool
+    ) -> None:
+        if self.history is not None:
+            kind = EventKind.lost if removed else EventKind.gained
+            self.history.push(member, kind, get_custom_status(member))
+
+        await self.send_log(config, member, removed=removed)
+        if not removed:
+            await self.send_thank_you(config, member)
+        self.award_role(config, member, removed=removed)
+
+    async def apply_debounced_transition(
+        self, member: discord.Member, removed: bool
+    ) -> None:
+        # the config might have changed while the transition was pending
+        config = await self.get_config(member.guild.id)
+        if config is None or not config.is_enabled:
+            return
+
+        await self.apply_transition(config, member, removed=removed)
+
+    def sync_guilds(self) -> None:
+        for guild_id in self.enabled_guild_ids:
+            guild = self.bot.get_guild(guild_id)
+            if guild is not None:
+                self.reconciler.start(guild, background=True)
+
+    async def chunk_guild(self, guild: discord.Guild) -> None:
+        if guild.chunked:
+            return
+
+        async with self._chunk_semaphore:
+            if guild.chunked:
+                return
+            try:
+                await guild.chunk(cache=True)
+            except Exception:
+                log.warning("Failed to chunk guild %s.", guild.id, exc_info=True)
             else:
-                if role not in member.roles:
-                    try:
-                        await member.add_roles(role, reason="Vanity role")
-                    except Exception:
-                        pass
+                self.stats["guilds_chunked"] += 1
+
+    async def chunk_guilds(self) -> None:
+        guilds = [
+            guild
+            for guild_id in self.enabled_guild_ids
+            if (guild := self.bot.get_guild(guild_id)) is not None
+            and not guild.chunked
+        ]
+        if not guilds:
+            return
+
+        started = time.perf_counter()
+        await asyncio.gather(*(self.chunk_guild(guild) for guild in guilds))
+        log.info(
+            "Chunked %s configured guilds in %.2fs (%.2fs after start).",
+            len(guilds),
+            time.perf_counter() - started,
+            time.perf_counter() - self.bot.started_at,
+        )
+
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        await self.configs_ready.wait()
+        if not self.bot.chunk_all_guilds:
+            # READY after a reconnect comes with fresh, unchunked guilds
+            await self.chunk_guilds()
+
+        # one sweep per process is enough
+        if self._swept_at_startup or not getattr(
+            self.bot.config, "vanity_sync_on_startup", False
+        ):
+            return
+
+        self._swept_at_startup = True
+        self.sync_guilds()
 
     @commands.Cog.listener()
+    @metrics.timed(metrics.listener_latency, "on_member_join")
     async def on_member_join(self, member: discord.Member) -> None:
-        if member.bot:
+        if not self.configs_ready.is_set():
+            await self.configs_ready.wait()
+
+        if member.bot or member.guild.id not in self.enabled_guild_ids:
             return
 
-        config = await self.get_guild_config(member.guild.id)
+        config = await self.get_config(member.guild.id)
         if config is None or not config.is_enabled:
             return
 
-        if not isinstance(member.activity, discord.CustomActivity):
+        status = get_custom_status(member)
+        if not config.matches(status):
             return
 
-        has_vanity = (
-            self.bot.config.strict_vanity
-            and member.activity.name == config.custom_status
-            or not self.bot.config.strict_vanity
-            and member.activity.name
-            and config.custom_status in member.activity.name
-        )
-        if not has_vanity:
-            return
+        if self.history is not None:
+            self.history.push(member, EventKind.joined, status)
 
         await self.send_log(config, member, removed=False)
         await self.send_thank_you(config, member)
-        await self.award_role(config, member, removed=False)
+        self.award_role(config, member, removed=False)
 
     @commands.Cog.listener()
+    @metrics.timed(metrics.listener_latency, "on_member_remove")
     async def on_member_remove(self, member: discord.Member) -> None:
-        if member.bot:
-            return
+        if not self.configs_ready.is_set():
+            await self.configs_ready.wait()
 
-        config = await self.get_guild_config(member.guild.id)
-        if config is None or not config.is_enabled:
+        if member.bot or member.guild.id not in self.enabled_guild_ids:
             return
 
-        if not isinstance(member.activity, discord.CustomActivity):
+        config = await self.get_config(member.guild.id)
+        if config is None or not config.is_enabled:
             return
 
-        had_vanity = (
-            self.bot.config.strict_vanity
-            and member.activity.name == config.custom_status
-            or not self.bot.config.strict_vanity
-            and member.activity.name
-            and config.custom_status in member.activity.name
-        )
+        had_vanity = None
+        if self.debouncer is not None:
+            # what we last announced, not what they happened to have on leave
+            had_vanity = self.debouncer.discard(member.guild.id, member.id)
+        if had_vanity is None:
+            had_vanity = config.matches(get_custom_status(member))
         if not had_vanity:
             return
 
+        if self.history is not None:
+            self.history.push(member, EventKind.left, get_custom_status(member))
+
         await self.send_log(config, member, removed=True)
 
     @commands.Cog.listener()
+    @metrics.timed(metrics.listener_latency, "on_presence_update")
     async def on_presence_update(
         self, before: discord.Member, after: discord.Member
     ) -> None:
-        if before.bot or after.bot:
+        # once the configs are ready everything up to the config lookup is
+        # synchronous on purpose, the vast majority of presence updates are
+        # rejected here
+        stats = self.stats
+        stats["presence_received"] += 1
+        if not self.configs_ready.is_set():
+            # hold the event until the preload finishes instead of dropping it
+            stats["presence_held"] += 1
+            await self.configs_ready.wait()
+
+        if after.guild.id not in self.enabled_guild_ids:
+            stats["presence_unconfigured"] += 1
+            return
+
+        before_status = get_custom_status(before)
+        after_status = get_custom_status(after)
+        if before_status == after_status:
+            stats["presence_unchanged"] += 1
             return
 
-        config = await self.get_guild_config(after.guild.id)
+        if after.bot:
+            return
+
+        config = await self.get_config(after.guild.id)
         if config is None or not config.is_enabled:
             return
 
-        before_has_status = (
-            isinstance(before.activity, discord.CustomActivity)
-            and self.bot.config.strict_vanity
-            and before.activity.name == config.custom_status
-            or isinstance(before.activity, discord.CustomActivity)
-            and not self.bot.config.strict_vanity
-            and before.activity.name
-            and config.custom_status in before.activity.name
-        )
-        after_has_status = (
-            isinstance(after.activity, discord.CustomActivity)
-            and self.bot.config.strict_vanity
-            and after.activity.name == config.custom_status
-            or isinstance(after.activity, discord.CustomActivity)
-            and not self.bot.config.strict_vanity
-            and after.activity.name
-            and config.custom_status in after.activity.name
-        )
+        stats["presence_handled"] += 1
+        before_has_status = config.matches(before_status)
+        after_has_status = config.matches(after_status)
 
-        if before_has_status and not after_has_status:
-            await self.send_log(config, after, removed=True)
-            await self.award_role(config, after, removed=True)
-        elif not before_has_status and after_has_status:
-            await self.send_log(config, after, removed=False)
-            await self.send_thank_you(config, after)
-            await self.award_role(config, after, removed=False)
+        if before_has_status is after_has_status:
+            return
+
+        if self.debouncer is not None:
+            self.debouncer.submit(after, before_has_status, after_has_status)
+            return
+
+        await self.apply_transition(config, after, removed=not after_has_status)
 
     @commands.hybrid_group(name="vanity", aliases=["vn"], hidden=True)
     @app_commands.allowed_contexts(guilds=True, dms=False, private_channels=False)
@@ -186,7 +732,7 @@ class Vanity(commands.Cog):
             UPDATE vanity_config SET custom_status = NULL WHERE guild_id = $1
             """
             await self.bot.pool.execute(query, ctx.guild.id)
-            self.get_guild_config.invalidate(ctx.guild.id)
+            await self.refresh_guild_config(ctx.guild.id)
             await ctx.approve("Removed the **custom status**.")
             return
 
@@ -199,7 +745,13 @@ class Vanity(commands.Cog):
         ON CONFLICT (guild_id) DO UPDATE SET custom_status = $2
         """
         await self.bot.pool.execute(query, ctx.guild.id, status)
-        self.get_guild_config.invalidate(ctx.guild.id)
+        await self.refresh_guild_config(ctx.guild.id)
+        if not ctx.guild.chunked:
+            # a newly configured guild, we need its members from now on
+            task = asyncio.create_task(self.chunk_guild(ctx.guild))
+            self._chunk_tasks.add(task)
+            task.add_done_callback(self._chunk_tasks.discard)
+
         await ctx.approve(f"Set the **custom status** to: `{status}`")
 
     @vanity.command(name="role", hidden=True)
@@ -216,7 +768,7 @@ class Vanity(commands.Cog):
             UPDATE vanity_config SET award_role_id = NULL WHERE guild_id = $1
             """
             await self.bot.pool.execute(query, ctx.guild.id)
-            self.get_guild_config.invalidate(ctx.guild.id)
+            await self.refresh_guild_config(ctx.guild.id)
             await ctx.approve("Removed the **award role**.")
             return
 
@@ -225,7 +777,7 @@ class Vanity(commands.Cog):
         ON CONFLICT (guild_id) DO UPDATE SET award_role_id = $2
         """
         await self.bot.pool.execute(query, ctx.guild.id, role.id)
-        self.get_guild_config.invalidate(ctx.guild.id)
+        await self.refresh_guild_config(ctx.guild.id)
         await ctx.approve(f"Set the **award role** to: {role.mention}")
 
     @vanity.command(name="channel", hidden=True)
@@ -242,7 +794,7 @@ class Vanity(commands.Cog):
             UPDATE vanity_config SET thank_you_channel_id = NULL WHERE guild_id = $1
             """
             await self.bot.pool.execute(query, ctx.guild.id)
-            self.get_guild_config.invalidate(ctx.guild.id)
+            await self.refresh_guild_config(ctx.guild.id)
             await ctx.approve("Removed the **thank you channel**.")
             return
         else:
@@ -251,7 +803,7 @@ class Vanity(commands.Cog):
             ON CONFLICT (guild_id) DO UPDATE SET thank_you_channel_id = $2
             """
             await self.bot.pool.execute(query, ctx.guild.id, channel.id)
-            self.get_guild_config.invalidate(ctx.guild.id)
+            await self.refresh_guild_config(ctx.guild.id)
             await ctx.approve(f"Set the **thank you channel** to: {channel.mention}")
 
     @vanity.command(name="log", hidden=True)
@@ -268,7 +820,7 @@ class Vanity(commands.Cog):
             UPDATE vanity_config SET log_channel_id = NULL WHERE guild_id = $1
             """
             await self.bot.pool.execute(query, ctx.guild.id)
-            self.get_guild_config.invalidate(ctx.guild.id)
+            await self.refresh_guild_config(ctx.guild.id)
             await ctx.approve("Removed the **log channel**.")
             return
         else:
@@ -277,7 +829,7 @@ class Vanity(commands.Cog):
             ON CONFLICT (guild_id) DO UPDATE SET log_channel_id = $2
             """
             await self.bot.pool.execute(query, ctx.guild.id, channel.id)
-            self.get_guild_config.invalidate(ctx.guild.id)
+            await self.refresh_guild_config(ctx.guild.id)
             await ctx.approve(f"Set the **log channel** to: {channel.mention}")
 
     @vanity.command(name="message", hidden=True)
@@ -294,7 +846,7 @@ class Vanity(commands.Cog):
             UPDATE vanity_config SET thank_you_message = NULL WHERE guild_id = $1
             """
             await self.bot.pool.execute(query, ctx.guild.id)
-            self.get_guild_config.invalidate(ctx.guild.id)
+            await self.refresh_guild_config(ctx.guild.id)
             await ctx.approve("Removed the **thank you message**.")
             return
         else:
@@ -303,9 +855,94 @@ class Vanity(commands.Cog):
             ON CONFLICT (guild_id) DO UPDATE SET thank_you_message = $2
             """
             await self.bot.pool.execute(query, ctx.guild.id, message)
-            self.get_guild_config.invalidate(ctx.guild.id)
+            await self.refresh_guild_config(ctx.guild.id)
             await ctx.approve("Set the **thank you message**")
 
+    @vanity.command(name="sync", hidden=True)
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_guild=True)
+    @commands.cooldown(1, 60.0, commands.BucketType.guild)
+    async def vanity_sync(self, ctx: GuildContext) -> None:
+        """Give or take the award role based on everyone's current status."""
+
+        config = await self.get_config(ctx.guild.id)
+        if config is None or not config.is_enabled:
+            await ctx.missing("There's no **custom status** set.")
+            return
+
+        if config.award_role is None:
+            await ctx.missing("There's no **award role** set.")
+            return
+
+        job = self.reconciler.start(ctx.guild)
+
+        def progress() -> discord.Embed:
+            return discord.Embed(
+                color=self.bot.colors.neutral,
+                description=(
+                    f"{self.bot.emotes.loading} {ctx.author.mention}: Syncing the **award role**, "
+                    f"checked **{job.position}/{job.total}** members "
+                    f"(**{job.added}** to add, **{job.removed}** to remove)"
+                ),
+            )
+
+        def expired() -> bool:
+            # a slash command's reply can only be edited within 15 minutes
+            return ctx.interaction is not None and ctx.interaction.is_expired()
+
+        message = await ctx.send(embed=progress())
+        while not job.done and job.running:
+            try:
+                await asyncio.wait_for(job.wait(), timeout=5.0)
+            except asyncio.TimeoutError:
+                if expired():
+                    continue
+                try:
+                    await message.edit(embed=progress())
+                except discord.HTTPException:
+                    pass
+
+        if not job.done:
+            # cancelled, a later sync picks up where this one stopped
+            embed = discord.Embed(
+                color=self.bot.colors.missing,
+                description=(
+                    f"{self.bot.emotes.warning} {ctx.author.mention}: Stopped syncing the **award role**, "
+                    f"checked **{job.position}/{job.total}** members "
+                    f"(**{job.added}** queued to add, **{job.removed}** queued to remove)"
+                ),
+            )
+        elif job.failed:
+            embed = discord.Embed(
+                color=self.bot.colors.missing,
+                description=(
+                    f"{self.bot.emotes.warning} {ctx.author.mention}: Failed to sync the **award role**, "
+                    f"checked **{job.position}/{job.total}** members "
+                    f"(**{job.added}** queued to add, **{job.removed}** queued to remove)"
+                ),
+            )
+        else:
+            embed = discord.Embed(
+                color=self.bot.colors.approve,
+                description=(
+                    f"{self.bot.emotes.approve} {ctx.author.mention}: Synced the **award role**, "
+                    f"checked **{job.total}** members in **{job.elapsed:.1f}s** "
+                    f"(**{job.added}** queued to add, **{job.removed}** queued to remove)"
+                ),
+            )
+        if not expired():
+            try:
+                await message.edit(embed=embed)
+                return
+            except discord.HTTPException:
+                pass
+
+        try:
+            # not through the interaction, its token may be gone
+            await ctx.channel.send(embed=embed)
+        except discord.HTTPException:
+            pass
+
     @vanity.command(name="reset", hidden=True)
     @commands.guild_only()
     @commands.has_guild_permissions(manage_guild=True)
@@ -316,5 +953,5 @@ class Vanity(commands.Cog):
         DELETE FROM vanity_config WHERE guild_id = $1
         """
         await self.bot.pool.execute(query, ctx.guild.id)
-        self.get_guild_config.invalidate(ctx.guild.id)
+        await self.refresh_guild_config(ctx.guild.id)
         await ctx.approve("Reset the **vanity** settings.")
@@ -18,9 +18,78 @@ can_whitelist = []
 # Whether to leave servers that don't have the vanity feature.
 only_vanity = False
 
+# How many servers to leave at once, and at most how many per second, when sweeping out servers
+# at startup (whitelist mode and only_vanity). The global rate limit is 50 requests per second.
+leave_concurrency = 5
+leave_rate = 40.0
+
+# Whether to request the members of every server at startup.
+# * When disabled only servers with a custom status set are chunked, which makes startup a lot faster.
+chunk_all_guilds = False
+
+# How many servers can have their members requested at once.
+chunk_concurrency = 2
+
 # Whether to use strict matches in user statuses.
 strict_vanity = False
 
+# How custom statuses are matched, overrides `strict_vanity` when set.
+# * "exact": the status has to be equal to the set one.
+# * "substring": the set status has to be somewhere in the status.
+# * "insensitive": like "substring" but ignores casing.
+# * "normalized": like "insensitive" but also applies Unicode NFKC normalization,
+#   so fancy/fullwidth lookalike characters match too.
+vanity_match_mode = None
+
+# Whether to listen for vanity config changes made by other processes (requires the V2 migration).
+vanity_config_notify = True
+
+# Whether to share vanity config rows between processes through Redis, so new processes warm up
+# from there instead of PostgreSQL. Keep vanity_config_notify on with this.
+vanity_config_redis = False
+
+# Whether to load every vanity config row (for this process's shards) into memory at startup.
+# * Recommended for large bots, events that arrive while loading are held until it's done.
+vanity_preload = False
+
+# How many seconds a member's custom status has to stay the same before gaining or losing the vanity counts.
+# * Status flaps inside the window collapse into their net change, 0 disables debouncing.
+vanity_debounce_window = 0.0
+
+# How many extra seconds to wait before treating a member as having lost the vanity.
+vanity_removal_grace = 0.0
+
+# How many role updates can be sent at once, they're queued and sent in the background.
+vanity_role_concurrency = 4
+
+# How many role updates per guild can be sent per amount of seconds.
+vanity_role_rate = (10, 10.0)
+
+# How many seconds to batch log channel entries for before sending them as one digest, 0 sends every entry on its own.
+vanity_log_digest_interval = 0.0
+
+# How many entries a log channel can have buffered before its digest is sent early.
+vanity_log_digest_size = 100
+
+# How many seconds have to pass before the same member can be thanked again.
+vanity_thank_you_cooldown = 30
+
+# Whether to sync the award role of every member in configured servers once the bot is ready.
+# * Fixes roles that drifted while the bot was offline, `/vanity sync` does the same for a single server.
+vanity_sync_on_startup = False
+
+# How many members per second a sync checks.
+vanity_sync_rate = 5000.0
+
+# Whether to record every vanity gain and loss in the `vanity_events` table.
+# * Requires the V3 migration, run `python launcher.py db upgrade`.
+vanity_event_history = False
+
+# The port to serve Prometheus metrics on at /metrics, None disables it.
+# * When running as a cluster every process needs its own port, the cluster ID is added to it.
+metrics_port = None
+metrics_host = "127.0.0.1"
+
 # The PostgreSQL database URI.
 postgresql = "postgresql://<user>:<password>@<host>/<database>"
 
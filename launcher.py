@@ -1,14 +1,18 @@
 from __future__ import annotations
-from typing import TypedDict
+from typing import Any, TypedDict
 
 import re
 import os
 import sys
 import json
 import uuid
+import math
+import time
 import click
 import logging
 import asyncio
+import aiohttp
+import multiprocessing
 import asyncpg
 import redis.asyncio as redis
 import discord
@@ -18,7 +22,7 @@ import contextlib
 from bot import Client
 
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 import config
 import traceback
@@ -210,7 +214,7 @@ def setup_logging():
             log.removeHandler(hdlr)
 
 
-async def create_pool() -> asyncpg.Pool:
+async def create_pool(*, size: int = 20) -> asyncpg.Pool:
     def _encode_jsonb(value):
         return json.dumps(value)
 
@@ -230,8 +234,8 @@ async def create_pool() -> asyncpg.Pool:
         config.postgresql,
         init=init,
         command_timeout=300,
-        max_size=20,
-        min_size=20,
+        max_size=size,
+        min_size=size,
     )
 
 
@@ -251,10 +255,17 @@ async def create_redis_pool() -> redis.Redis:
     return r
 
 
-async def run_bot():
+async def run_bot(
+    *,
+    shard_ids: list[int] | None = None,
+    shard_count: int | None = None,
+    cluster_id: int | None = None,
+    pool_size: int = 20,
+    ready: Any | None = None,
+):
     log = logging.getLogger()
     try:
-        pool = await create_pool()
+        pool = await create_pool(size=pool_size)
     except Exception:
         click.echo("Could not set up PostgreSQL. Exiting.", file=sys.stderr)
         log.exception("Could not set up PostgreSQL. Exiting.")
@@ -267,9 +278,19 @@ async def run_bot():
         log.exception("Could not set up Redis. Exiting.")
         return
 
-    async with Client() as bot:
+    async with Client(
+        shard_ids=shard_ids, shard_count=shard_count, cluster_id=cluster_id
+    ) as bot:
         bot.pool = pool
         bot.redis = r
+        if ready is not None:
+            # lets the cluster supervisor know it can start the next worker
+            async def notify_ready() -> None:
+                await bot.wait_until_ready()
+                ready.set()
+
+            asyncio.create_task(notify_ready())
+
         await bot.start()
 
 
@@ -313,6 +334,278 @@ def slash():
     asyncio.run(register_slash_commands())
 
 
+async def fetch_shard_count() -> int:
+    url = "https://discord.com/api/v10/gateway/bot"
+    headers = {"Authorization": f"Bot {config.token}"}
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, headers=headers) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+            return data["shards"]
+
+
+class ClusterFilter(logging.Filter):
+    def __init__(self, cluster_id: int):
+        super().__init__()
+        self.cluster_id: int = cluster_id
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.name = f"cluster-{self.cluster_id}.{record.name}"
+        return True
+
+
+def run_cluster_worker(
+    cluster_id: int,
+    shard_ids: list[int],
+    shard_count: int,
+    pool_size: int,
+    log_queue: Any,
+    ready: Any,
+) -> None:
+    # every record is shipped to the supervisor, which owns the log files
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    handler = QueueHandler(log_queue)
+    handler.addFilter(ClusterFilter(cluster_id))
+    log.addHandler(handler)
+    logging.getLogger("discord").setLevel(logging.INFO)
+    logging.getLogger("discord.http").setLevel(logging.WARNING)
+    logging.getLogger("discord.state").addFilter(RemoveNoise())
+
+    asyncio.run(
+        run_bot(
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+            cluster_id=cluster_id,
+            pool_size=pool_size,
+            ready=ready,
+        )
+    )
+
+
+class Worker:
+    def __init__(self, cluster_id: int, shard_ids: list[int]) -> None:
+        self.cluster_id: int = cluster_id
+        self.shard_ids: list[int] = shard_ids
+        self.process: multiprocessing.process.BaseProcess | None = None
+        self.ready: Any = None
+        self.started_at: float = 0.0
+        self.restarts: int = 0
+
+
+class Supervisor:
+    """Runs the shards split over worker processes and restarts them if they die."""
+
+    def __init__(self, *, processes: int, shard_count: int, pool_size: int) -> None:
+        self.context = multiprocessing.get_context("spawn")
+        self.log_queue: Any = self.context.Queue()
+        self.shard_count: int = shard_count
+        self.pool_size: int = pool_size
+        per_process = math.ceil(shard_count / processes)
+        self.workers: list[Worker] = [
+            Worker(i, list(range(start, min(start + per_process, shard_count))))
+            for i, start in enumerate(range(0, shard_count, per_process))
+        ]
+
+    def spawn(self, worker: Worker) -> None:
+        worker.ready = self.context.Event()
+        worker.process = self.context.Process(
+            target=run_cluster_worker,
+            name=f"cluster-{worker.cluster_id}",
+            args=(
+                worker.cluster_id,
+                worker.shard_ids,
+                self.shard_count,
+                self.pool_size,
+                self.log_queue,
+                worker.ready,
+            ),
+            daemon=True,
+        )
+        worker.started_at = time.monotonic()
+        worker.process.start()
+
+    def wait_until_ready(self, worker: Worker) -> None:
+        # IDENTIFYs are rate limited for the whole bot, not per process,
+        # so workers connect one after another
+        timeout = 60.0 + 10.0 * len(worker.shard_ids)
+        assert worker.ready is not None and worker.process is not None
+        deadline = time.monotonic() + timeout
+        while not worker.ready.wait(1.0):
+            if not worker.process.is_alive() or time.monotonic() > deadline:
+                return
+
+    def stop(self) -> None:
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout=10.0)
+
+    def run(self) -> None:
+        log = logging.getLogger()
+        listener = QueueListener(
+            self.log_queue, *log.handlers, respect_handler_level=True
+        )
+        listener.start()
+        try:
+            for worker in self.workers:
+                log.info(
+                    "Starting cluster %s with shards %s-%s.",
+                    worker.cluster_id,
+                    worker.shard_ids[0],
+                    worker.shard_ids[-1],
+                )
+                self.spawn(worker)
+                self.wait_until_ready(worker)
+
+            while True:
+                time.sleep(5.0)
+                for worker in self.workers:
+                    assert worker.process is not None
+                    if worker.process.is_alive():
+                        continue
+
+                    uptime = time.monotonic() - worker.started_at
+                    log.warning(
+                        "Cluster %s exited with code %s after %.0fs, restarting.",
+                        worker.cluster_id,
+                        worker.process.exitcode,
+                        uptime,
+                    )
+                    # back off if it keeps dying right away
+                    worker.restarts = worker.restarts + 1 if uptime < 60.0 else 0
+                    time.sleep(min(2**worker.restarts, 60))
+                    self.spawn(worker)
+                    self.wait_until_ready(worker)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            listener.stop()
+
+
+@main.command()
+@click.option(
+    "--processes",
+    "-p",
+    type=int,
+    default=os.cpu_count() or 1,
+    help="The number of worker processes.",
+)
+@click.option(
+    "--shards",
+    "-s",
+    type=int,
+    default=None,
+    help="The total shard count, asks Discord if not set.",
+)
+@click.option(
+    "--pool-size",
+    type=int,
+    default=10,
+    help="The PostgreSQL pool size of every worker.",
+)
+def cluster(processes, shards, pool_size):
+    """Runs the bot with its shards split across processes"""
+    with setup_logging():
+        shard_count = shards or asyncio.run(fetch_shard_count())
+        processes = max(1, min(processes, shard_count))
+        click.echo(f"Running {shard_count} shards across {processes} processes.")
+        supervisor = Supervisor(
+            processes=processes, shard_count=shard_count, pool_size=pool_size
+        )
+        supervisor.run()
+
+
+@main.command()
+@click.option("--events", "-e", type=int, default=100_000, help="Presence updates to send.")
+@click.option("--guilds", "-g", type=int, default=1000, help="The number of guilds.")
+@click.option("--members", "-m", type=int, default=200, help="Members per guild.")
+@click.option(
+    "--configured",
+    type=float,
+    default=0.1,
+    help="The share of guilds with a vanity set up.",
+)
+@click.option(
+    "--match",
+    type=float,
+    default=0.2,
+    help="The share of members repping the vanity.",
+)
+@click.option(
+    "--flap",
+    type=float,
+    default=0.05,
+    help="The share of updates that change the custom status.",
+)
+@click.option("--seed", type=int, default=0, help="The random seed of the workload.")
+@click.option("--allocations", is_flag=True, help="Trace memory allocations too.")
+def bench(events, guilds, members, configured, match, flap, seed, allocations):
+    """Runs synthetic presence updates through the vanity cog"""
+    import benchmark
+
+    workload = benchmark.Workload(
+        events=events,
+        guilds=guilds,
+        members=members,
+        configured=configured,
+        match=match,
+        flap=flap,
+        seed=seed,
+    )
+    report = asyncio.run(benchmark.run(workload, trace_allocations=allocations))
+    for line in report.lines():
+        click.echo(line)
+
+
+@main.command()
+@click.argument("path", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option(
+    "--speed",
+    type=float,
+    default=1.0,
+    help="How much faster than recorded to replay, 0 for as fast as possible.",
+)
+@click.option("--allocations", is_flag=True, help="Trace memory allocations too.")
+def replay(path, speed, allocations):
+    """Replays a gateway recording through the vanity cog"""
+    import benchmark
+
+    report = asyncio.run(
+        benchmark.replay(path, speed=speed or None, trace_allocations=allocations)
+    )
+    for line in report.lines():
+        click.echo(line)
+
+
+async def remove_legacy_whitelist_keys() -> int:
+    # the whitelist used to be one whitelist:<guild_id> key per guild
+    r = await create_redis_pool()
+    removed = 0
+    try:
+        batch: list[bytes] = []
+        async for key in r.scan_iter(match="whitelist:*", count=1000):
+            batch.append(key)
+            if len(batch) == 1000:
+                removed += await r.unlink(*batch)
+                batch = []
+        if batch:
+            removed += await r.unlink(*batch)
+    finally:
+        await r.aclose()
+    return removed
+
+
+@main.command()
+def migrate_whitelist():
+    """Removes the old per guild whitelist keys"""
+    removed = asyncio.run(remove_legacy_whitelist_keys())
+    click.secho(f"Removed {removed} legacy whitelist key(s)", fg="green")
+
+
 @main.group(short_help="database stuff", options_metavar="[options]")
 def db():
     pass
@@ -0,0 +1,20 @@
+-- Revises: V1
+-- Creation Date: 2026-10-17 09:12:41.503118 UTC
+-- Reason: vanity config notify
+
+CREATE OR REPLACE FUNCTION notify_vanity_config() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('vanity_config', OLD.guild_id::text);
+    ELSE
+        PERFORM pg_notify('vanity_config', NEW.guild_id::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS vanity_config_notify ON vanity_config;
+
+CREATE TRIGGER vanity_config_notify
+AFTER INSERT OR UPDATE OR DELETE ON vanity_config
+FOR EACH ROW EXECUTE FUNCTION notify_vanity_config();
@@ -0,0 +1,16 @@
+-- Revises: V2
+-- Creation Date: 2026-10-17 11:47:03.218455 UTC
+-- Reason: vanity events
+
+-- kind: 1 = gained, 2 = lost, 3 = joined with the vanity, 4 = left with the vanity
+CREATE TABLE IF NOT EXISTS vanity_events (
+    id BIGSERIAL PRIMARY KEY,
+    guild_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    kind SMALLINT NOT NULL,
+    status TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT (now() at time zone 'utc')
+);
+
+CREATE INDEX IF NOT EXISTS idx_vanity_events_guild_id_created_at ON vanity_events (guild_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_vanity_events_user_id ON vanity_events (user_id);